@@ -0,0 +1,189 @@
+import math
+import os
+import threading
+import time
+
+from pymongo import ReturnDocument
+
+
+# Token buckets per route class: (tokens added per second, bucket size)
+RATE_LIMITS = {
+    "write": (10 / 60, 10),  # new listings and inquiries
+    "upload": (30 / 60, 30),
+    "search": (5, 30),
+}
+
+# Route class of each rate limited endpoint; everything else is browsing
+ROUTE_CLASSES = {
+    "api.add_vehicle": "write",
+    "api.add_vehicles_bulk": "write",
+    "api.add_inquiry": "write",
+    "api.upload_file": "upload",
+    "api.search_vehicles": "search",
+    "api.get_vehicle_facets": "search",
+    "api.get_stats": "search",
+}
+
+# Never limited, so monitoring still works under load
+UNLIMITED_ENDPOINTS = {"api.health", "api.get_metrics"}
+
+# Set in the WSGI environ by a server that has already counted the request
+# against the ConcurrencyLimiter (asgi.py does, before queueing it)
+ADMITTED_KEY = "gaadimarket.admitted"
+
+# "memory" keeps buckets per process, "mongo" shares them through the
+# rate_limits collection, "off" disables rate limiting
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+
+# Requests a process handles at once before it answers 503.  Rate limited
+# classes only get the first SHED_SHARE of them, so a burst of writes or
+# searches is shed while browsing still has room.
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 64))
+SHED_SHARE = 0.5
+SERVER_BUSY = "Server busy, please retry shortly."
+
+
+def trusted_proxies(env=None):
+    """Proxies in front of the app that write X-Forwarded-For, from TRUSTED_PROXIES.
+
+    Rate limits key on the address the nearest trusted proxy saw, so this
+    must match the deployment: 1 behind one reverse proxy (nginx, a load
+    balancer), 2 behind a CDN and then nginx.  Vercel's edge sets the
+    header to the client address and its runtime sets VERCEL, so there it
+    defaults to 1; anywhere else it defaults to 0, trusting no header.
+    """
+    env = os.environ if env is None else env
+    value = env.get("TRUSTED_PROXIES")
+    if value not in (None, ""):
+        return int(value)
+    return 1 if env.get("VERCEL") else 0
+
+
+TRUSTED_PROXIES = trusted_proxies()
+
+warned_untrusted = False
+
+
+def route_class(endpoint, method):
+    """The rate limit class of a request, or None for browsing; CORS preflights don't spend tokens."""
+    return ROUTE_CLASSES.get(endpoint) if method != "OPTIONS" else None
+
+
+def client_ip(request):
+    global warned_untrusted
+    forwarded = [part.strip() for part in request.headers.get("X-Forwarded-For", "").split(",") if part.strip()]
+    if TRUSTED_PROXIES and len(forwarded) >= TRUSTED_PROXIES:
+        return forwarded[-TRUSTED_PROXIES]
+    if forwarded and not TRUSTED_PROXIES and not warned_untrusted:
+        warned_untrusted = True
+        print("X-Forwarded-For is set but TRUSTED_PROXIES is 0; "
+              "every client behind the proxy shares one rate limit")
+    return request.remote_addr or ""
+
+
+class MemoryBuckets:
+    """Token buckets in this process."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = {}  # key -> [tokens, updated_at, rate, burst]
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take a token; returns (allowed, seconds until one is available)."""
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self.prune(now)
+                bucket = self.buckets[key] = [burst, now, rate, burst]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            allowed = tokens >= 1
+            bucket[0] = tokens - 1 if allowed else tokens
+            bucket[1] = now
+            return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def prune(self, now):
+        # Buckets that have refilled since their last request hold nothing worth keeping
+        for key, (tokens, updated_at, rate, burst) in list(self.buckets.items()):
+            if tokens + (now - updated_at) * rate >= burst:
+                del self.buckets[key]
+
+
+class MongoBuckets:
+    """Token buckets in a Mongo collection, shared by every worker and instance.
+
+    Each take is one find_one_and_update whose pipeline refills and takes
+    on the server, against the server's clock.  Buckets not touched for an
+    hour are dropped by the TTL index in indexes.py.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def take(self, key, rate, burst):
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+        bucket = self.collection.find_one_and_update(
+            {"_id": "/".join(key)},
+            [
+                {"$set": {"tokens": refilled, "updated_at": "$$NOW"}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return bucket["allowed"], 0 if bucket["allowed"] else (1 - bucket["tokens"]) / rate
+
+
+class RateLimiter:
+    def __init__(self, backend, limits=RATE_LIMITS):
+        self.backend = backend
+        self.limits = limits
+
+    def take(self, route_class, client):
+        """(allowed, Retry-After seconds) for one request from client."""
+        rate, burst = self.limits[route_class]
+        try:
+            allowed, wait = self.backend.take((route_class, client), rate, burst)
+        except Exception as e:
+            # A limiter that can't reach its store lets traffic through
+            print("Error checking rate limit:", e)
+            return True, 0
+        return allowed, math.ceil(wait)
+
+
+class ConcurrencyLimiter:
+    """Counts the requests in flight in this process and sheds the ones over the limit.
+
+    Under asgi.py a request counts from the moment it arrives, so requests
+    waiting for a worker thread are in flight too and the limits bound the
+    queue.  Under a threaded WSGI server only running requests are counted.
+    """
+
+    def __init__(self, limit=MAX_IN_FLIGHT, shed_share=SHED_SHARE):
+        self.limit = limit
+        self.shed_limit = max(1, int(limit * shed_share))
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, sheddable):
+        with self.lock:
+            if self.in_flight >= (self.shed_limit if sheddable else self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def gauges(self):
+        return [
+            ("gaadimarket_requests_in_flight", "Requests being handled by this process", self.in_flight),
+            ("gaadimarket_requests_in_flight_limit", "Requests in flight past which this process answers 503", self.limit),
+        ]
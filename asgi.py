@@ -0,0 +1,194 @@
+"""ASGI entry point: ``uvicorn asgi:app``.
+
+Serves the same Flask routes as wsgi.py.  Each request runs on a bounded
+thread pool, so a handler waiting on Mongo holds a thread rather than a whole
+worker process, and the event loop only shuttles bytes.  Request bodies are
+pulled from the client as the handler reads them and responses are sent as
+they are produced, so uploads and large listings stream in both directions.
+
+Requests are counted against the app's ConcurrencyLimiter as they arrive,
+before they wait for a thread.  With the defaults (ASGI_THREADS=32,
+MAX_IN_FLIGHT=64) searches and writes get 503 once every thread is busy,
+and browsing once 32 more requests are queued.
+"""
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import ADMITTED_KEY, SERVER_BUSY, UNLIMITED_ENDPOINTS, route_class
+from app import app as flask_app, concurrency, metrics
+
+
+class RequestBody:
+    """wsgi.input that reads the ASGI request body on demand from a worker thread."""
+
+    def __init__(self, receive, call):
+        self.receive = receive
+        self.call = call
+        self.buffer = bytearray()
+        self.more = True
+
+    def fill(self):
+        message = self.call(self.receive())
+        if message["type"] == "http.disconnect":
+            self.more = False
+            raise OSError("Client disconnected")
+        self.buffer += message.get("body", b"")
+        self.more = message.get("more_body", False)
+
+    def read(self, size=-1):
+        while self.more and (size is None or size < 0 or len(self.buffer) < size):
+            self.fill()
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readline(self, size=-1):
+        while self.more and b"\n" not in self.buffer and (size < 0 or len(self.buffer) < size):
+            self.fill()
+        end = self.buffer.find(b"\n") + 1 or len(self.buffer)
+        if size >= 0:
+            end = min(end, size)
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+def build_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+class WSGIThreadPoolApp:
+    def __init__(self, wsgi_app, threads, limiter=None, metrics=None):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+        self.limiter = limiter
+        self.metrics = metrics
+        self.urls = wsgi_app.url_map.bind("localhost")
+
+    def route(self, scope):
+        """The endpoint and rule a request will be dispatched to, or (None, None)."""
+        try:
+            rule, _ = self.urls.match(scope["path"], scope["method"], return_rule=True)
+        except Exception:
+            return None, None
+        return rule.endpoint, rule.rule
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported scope type {scope['type']}")
+        loop = asyncio.get_running_loop()
+        endpoint, rule = self.route(scope)
+        counted = self.limiter is not None and endpoint not in UNLIMITED_ENDPOINTS
+        if counted:
+            # Counted before the executor, so the queue it holds is bounded
+            if not self.limiter.acquire(sheddable=route_class(endpoint, scope["method"]) is not None):
+                if self.metrics:
+                    self.metrics.record_request(rule or "<unmatched>", scope["method"], 503, 0.0)
+                return await self.shed(scope, send)
+        try:
+            await loop.run_in_executor(self.executor, self.run, scope, receive, send, loop, counted)
+        finally:
+            if counted:
+                self.limiter.release()
+
+    async def shed(self, scope, send):
+        body = json.dumps({"error": SERVER_BUSY}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                   (b"retry-after", b"1")]
+        # The app's CORS settings, so the browser lets the page read the 503
+        origin = dict(scope.get("headers", [])).get(b"origin")
+        if origin:
+            headers += [(b"access-control-allow-origin", origin), (b"access-control-allow-credentials", b"true")]
+        await send({"type": "http.response.start", "status": 503, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def run(self, scope, receive, send, loop, admitted=False):
+        """Call the WSGI app on this worker thread, relaying I/O through the event loop."""
+        def call(coroutine):
+            return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get("started"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers]
+            return write
+
+        def start():
+            if not response.get("started"):
+                response["started"] = True
+                call(send({"type": "http.response.start", "status": response["status"], "headers": response["headers"]}))
+
+        def write(data):
+            start()
+            call(send({"type": "http.response.body", "body": data, "more_body": True}))
+
+        environ = build_environ(scope, RequestBody(receive, call))
+        environ[ADMITTED_KEY] = admitted
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    write(chunk)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        start()
+        call(send({"type": "http.response.body", "body": b"", "more_body": False}))
+
+
+app = WSGIThreadPoolApp(flask_app, threads=int(os.environ.get("ASGI_THREADS", 32)), limiter=concurrency,
+                        metrics=metrics)
@@ -0,0 +1,405 @@
+"""Benchmark the API against a seeded synthetic catalog.
+
+    python bench.py --products 10000 --inquiries 20000 --out before.json
+    python bench.py --stand-in --products 10000 --out before.json
+    python bench.py --products 10000 --out after.json --compare before.json
+    python bench.py --encoding
+
+Each scenario is driven through the Flask test client and over HTTP (a
+threaded server on a free local port) at a fixed concurrency.  The report
+has p50/p95/p99 latency, throughput and Mongo queries per request.
+--stand-in runs against mongomock (pip install mongomock) in this process
+instead of a mongod.
+Rate limiting is off unless --rate-limit is given: every benchmark
+request comes from one address.
+The same --seed always gives the same catalog and request mix.
+--encoding times the response encoder against bson.json_util.dumps on
+listing pages of synthetic documents instead, without any database.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+from bson import json_util
+from pymongo import monitoring
+
+import encoding
+import loader
+from locations import get_location_index
+
+
+class QueryCounter(monitoring.CommandListener):
+    """Counts Mongo commands issued by the app while a scenario runs."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self):
+        with self.lock:
+            self.count += 1
+
+    def started(self, event):
+        self.add()
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Collection methods that reach the server; mongomock has no command monitoring
+STAND_IN_METHODS = (
+    "find", "find_one", "aggregate", "count_documents", "insert_one", "insert_many",
+    "update_one", "update_many", "replace_one", "delete_one", "delete_many",
+    "find_one_and_update", "find_one_and_delete", "bulk_write",
+)
+
+
+def count_stand_in_calls(counter):
+    from mongomock.collection import Collection
+
+    # mongomock implements some methods with others (find_one calls find),
+    # so only the outermost call on a thread is a query
+    depth = threading.local()
+
+    def counted(method):
+        def call(self, *args, **kwargs):
+            depth.value = getattr(depth, "value", 0) + 1
+            if depth.value == 1:
+                counter.add()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                depth.value -= 1
+        return call
+
+    for name in STAND_IN_METHODS:
+        setattr(Collection, name, counted(getattr(Collection, name)))
+
+
+class Scenario:
+    def __init__(self, name, method, paths, settings=None):
+        self.name = name
+        self.method = method
+        self.paths = paths  # request number -> path
+        self.settings = settings or {}  # app module globals to override while it runs
+
+
+def build_scenarios(args, static_asset):
+    rng = random.Random(args.seed)
+    categories = list(loader.SYNTHETIC_CATALOG)
+    # mark_as_sold consumes an inquiry per call, so every request takes the next one
+    inquiries = itertools.count()
+
+    def search_query():
+        category = rng.choice(categories)
+        brand = rng.choice(list(loader.SYNTHETIC_CATALOG[category]))
+        return f"{brand} {rng.choice(loader.SYNTHETIC_CATALOG[category][brand])}".lower()
+
+    def vehicle(number):
+        return str(loader.synthetic_id(1, rng.randrange(args.products)))
+
+    cities = [city for state, city in sorted(get_location_index().cities.values(), key=lambda found: found[1]["name"])]
+
+    def near_city(number):
+        return f"/api/vehicles?near={quote(rng.choice(cities)['name'])}&radius_km=100&limit={args.page_size}"
+
+    def near_point(number):
+        city = rng.choice(cities)
+        return f"/api/vehicles?near={city['latitude']},{city['longitude']}&radius_km=100&limit={args.page_size}"
+
+    return [
+        Scenario("vehicles_page", "GET", lambda number: f"/api/vehicles?limit={args.page_size}"),
+        Scenario("vehicles_filtered", "GET",
+                 lambda number: f"/api/vehicles?category={quote(rng.choice(categories))}&limit={args.page_size}"),
+        Scenario("facets", "GET", lambda number: f"/api/vehicles/facets?category={quote(rng.choice(categories))}"),
+        Scenario("vehicle_detail", "GET", lambda number: f"/api/vehicles/{vehicle(number)}"),
+        # $geoNear on the 2dsphere index; mongomock has no $geoNear, so the
+        # stand-in only runs the grid scenario
+        *([] if args.stand_in else [Scenario("vehicles_near", "GET", near_city)]),
+        Scenario("vehicles_near_grid", "GET", near_point, settings={"GEO_SEARCH_BACKEND": "grid"}),
+        Scenario("search", "GET", lambda number: f"/api/search?q={quote(search_query())}&limit={args.page_size}"),
+        Scenario("inquiries_page", "GET", lambda number: f"/api/inquiries?limit={args.page_size}"),
+        Scenario("static_index", "GET", lambda number: "/"),
+        Scenario("static_asset", "GET", lambda number: static_asset),
+        Scenario("mark_as_sold", "PATCH",
+                 lambda number: f"/api/mark_sold/{loader.synthetic_id(2, next(inquiries) % max(args.inquiries, 1))}"),
+    ]
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(send, scenario, requests, concurrency, counter, warmup):
+    for number in range(warmup):
+        send(scenario.method, scenario.paths(number))
+
+    paths = [scenario.paths(number) for number in range(requests)]
+    latencies = []
+    statuses = Counter()
+
+    def one(path):
+        started = time.perf_counter()
+        status = send(scenario.method, path)
+        latencies.append(time.perf_counter() - started)
+        statuses[status] += 1
+
+    queries = counter.count
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, paths))
+    elapsed = time.perf_counter() - started
+    queries = counter.count - queries
+
+    ordered = sorted(latencies)
+    return {
+        "requests": requests,
+        "errors": sum(count for status, count in statuses.items() if status >= 500),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "queries_per_request": round(queries / requests, 2),
+    }
+
+
+def test_client_sender(flask_app):
+    local = threading.local()
+
+    def send(method, path):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = flask_app.test_client()
+        response = client.open(path, method=method)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    return send
+
+
+def start_http_server(flask_app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True, request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def http_sender(port):
+    local = threading.local()
+
+    def send(method, path):
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection("127.0.0.1", port)
+        try:
+            connection.request(method, path)
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            local.connection = None
+            connection.close()
+            raise
+        return response.status
+
+    return send
+
+
+def compare(results, baseline, threshold):
+    """Print p95 changes against an earlier run; True if any scenario got slower than threshold."""
+    previous = {(row["scenario"], row["transport"]): row for row in baseline["results"]}
+    regressed = False
+    for row in results["results"]:
+        old = previous.get((row["scenario"], row["transport"]))
+        if not old or not old["p95_ms"]:
+            continue
+        change = row["p95_ms"] / old["p95_ms"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{row['scenario']:>18} {row['transport']:>11}  p95 {old['p95_ms']:8.2f} -> {row['p95_ms']:8.2f} ms"
+              f" ({change:+.1%}){flag}")
+    return regressed
+
+
+def time_call(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def encoding_benchmark(sizes, repeat, seed):
+    """Best-of-repeat time to encode listing pages of each size, old and new."""
+    from app import LISTING_EXCLUDED_FIELDS
+
+    rng = random.Random(seed)
+    with open(loader.LOCATION_FILE, "r") as file:
+        states = list(loader.iter_json_array(file))
+    documents = list(loader.synthetic_vehicles(max(sizes), rng, states))
+    for document in documents:
+        for field in LISTING_EXCLUDED_FIELDS:
+            document.pop(field, None)
+        document["created_at"] = loader.SYNTHETIC_EPOCH
+
+    rows = []
+    for size in sizes:
+        page = documents[:size]
+        if json.loads(encoding.dumps(page)) != json.loads(json_util.dumps(page)):
+            raise SystemExit(f"encoding.dumps and json_util.dumps disagree on {size} documents")
+        old = time_call(lambda: json_util.dumps(page), repeat)
+        new = time_call(lambda: encoding.dumps(page), repeat)
+        streamed = time_call(lambda: "".join(encoding.iter_list(page)), repeat)
+        rows.append({
+            "documents": size,
+            "json_util_ms": round(old * 1000, 3),
+            "encoding_ms": round(new * 1000, 3),
+            "streamed_ms": round(streamed * 1000, 3),
+            "speedup": round(old / new, 1),
+        })
+        print(f"{size:>8} docs  json_util {old * 1000:9.3f} ms  encoding {new * 1000:9.3f} ms"
+              f"  streamed {streamed * 1000:9.3f} ms  {old / new:5.1f}x")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API against a seeded synthetic catalog.")
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="GaadiMarketBench")
+    parser.add_argument("--stand-in", action="store_true", help="use an in-process mongomock database")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--inquiries", type=int, default=None, help="defaults to twice --products")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the catalog already in --db")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario and transport")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep the per-client rate limits on (RATE_LIMIT_BACKEND is set to off otherwise)")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--transport", choices=["test_client", "http", "both"], default="both")
+    parser.add_argument("--scenarios", help="comma separated subset of scenarios")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier results file to compare p95 latency against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="p95 slowdown that counts as a regression")
+    parser.add_argument("--encoding", action="store_true", help="benchmark the response encoder only")
+    parser.add_argument("--encoding-sizes", default="20,100,1000,10000", help="comma separated page sizes")
+    args = parser.parse_args(argv)
+    if args.encoding:
+        sizes = [int(size) for size in args.encoding_sizes.split(",")]
+        rows = encoding_benchmark(sizes, repeat=5, seed=args.seed)
+        if args.out:
+            with open(args.out, "w") as file:
+                json.dump({"encoding": rows}, file, indent=2)
+        return
+    if args.inquiries is None:
+        args.inquiries = args.products * 2
+
+    if not args.rate_limit:
+        # Every benchmark request comes from one address, so the per-client
+        # limits would answer most of them 429
+        os.environ["RATE_LIMIT_BACKEND"] = "off"
+    import app as app_module
+    from static_assets import get_asset_table
+
+    counter = QueryCounter()
+    flask_app = app_module.create_app({"MONGO_URI": args.uri, "MONGO_DB": args.db})
+    if args.stand_in:
+        import mongomock
+        app_module.mongo.use(mongomock.MongoClient())
+        count_stand_in_calls(counter)
+    else:
+        app_module.mongo.listeners.append(counter)
+    db = app_module.mongo.database()
+
+    if not args.no_seed:
+        started = time.perf_counter()
+        loader.seed(db, args.products, args.inquiries, random_seed=args.seed)
+        print(f"seeded {args.products} products and {args.inquiries} inquiries in {time.perf_counter() - started:.1f}s")
+
+    table = get_asset_table(app_module.front_end_folder)
+    static_asset = next((url for url, asset in sorted(table.assets.items()) if asset.immutable), "/index.html")
+
+    scenarios = build_scenarios(args, static_asset)
+    if args.scenarios:
+        wanted = set(args.scenarios.split(","))
+        scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+
+    senders = []
+    server = None
+    if args.transport in ("test_client", "both"):
+        senders.append(("test_client", test_client_sender(flask_app)))
+    if args.transport in ("http", "both"):
+        server = start_http_server(flask_app)
+        senders.append(("http", http_sender(server.server_port)))
+
+    results = {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat() + "Z",
+            "backend": "mongomock" if args.stand_in else args.uri,
+            "products": args.products,
+            "inquiries": args.inquiries,
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+        },
+        "results": [],
+    }
+    try:
+        for scenario in scenarios:
+            saved = {name: getattr(app_module, name) for name in scenario.settings}
+            for name, value in scenario.settings.items():
+                setattr(app_module, name, value)
+            for transport, send in senders:
+                row = {"scenario": scenario.name, "transport": transport}
+                row.update(run_scenario(send, scenario, args.requests, args.concurrency, counter, args.warmup))
+                results["results"].append(row)
+                print(f"{scenario.name:>18} {transport:>11}  p50 {row['p50_ms']:8.2f}  p95 {row['p95_ms']:8.2f}"
+                      f"  p99 {row['p99_ms']:8.2f} ms  {row['throughput_rps']:8.1f} req/s"
+                      f"  {row['queries_per_request']:5.2f} q/req  {row['statuses']}")
+            for name, value in saved.items():
+                setattr(app_module, name, value)
+    finally:
+        if server:
+            server.shutdown()
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as file:
+            if compare(results, json.load(file), args.threshold):
+                raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
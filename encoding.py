@@ -0,0 +1,127 @@
+import json
+import math
+from datetime import datetime
+
+from bson import Decimal128, ObjectId, json_util
+from flask.json.provider import DefaultJSONProvider
+
+
+# Every response goes through one of two encoders built on the C json
+# encoder; Python code only runs for the BSON values inside a document.
+#
+# extended: the catalog routes.  Same output as bson.json_util.dumps
+#   (relaxed mode), which the listing pages read as _id.$oid.
+# plain: everything else, installed as the Flask JSON provider so jsonify
+#   uses it.  The admin pages read _id as a string and pass created_at to
+#   new Date(), so ids and decimals become strings and dates ISO 8601.
+#
+# Neither writes bare NaN or Infinity, which JSON has no literal for: a
+# document holding one is encoded again with each non-finite float written
+# as json_util does, {"$numberDouble": "NaN"}.
+
+def extended_datetime(value):
+    if value.tzinfo is None and value.year >= 1970:
+        if value.microsecond < 1000:
+            return {"$date": value.isoformat(timespec="seconds") + "Z"}
+        return {"$date": value.isoformat(timespec="milliseconds") + "Z"}
+    return json_util.default(value)
+
+
+def plain_datetime(value):
+    if value.tzinfo is None:
+        return value.isoformat(timespec="milliseconds") + "Z"
+    return value.isoformat(timespec="milliseconds")
+
+
+EXTENDED_TYPES = {
+    ObjectId: lambda value: {"$oid": str(value)},
+    datetime: extended_datetime,
+    Decimal128: lambda value: {"$numberDecimal": str(value)},
+}
+
+PLAIN_TYPES = {
+    ObjectId: str,
+    datetime: plain_datetime,
+    Decimal128: str,
+}
+
+
+def extended_default(value):
+    encode = EXTENDED_TYPES.get(type(value))
+    if encode is None:
+        return json_util.default(value)
+    return encode(value)
+
+
+def plain_default(value):
+    encode = PLAIN_TYPES.get(type(value))
+    if encode is None:
+        return extended_default(value)
+    return encode(value)
+
+
+NON_FINITE = {"nan": "NaN", "inf": "Infinity", "-inf": "-Infinity"}
+
+
+def finite(value):
+    """value with its non-finite floats replaced by their $numberDouble form."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else {"$numberDouble": NON_FINITE[repr(value)]}
+    if isinstance(value, dict):
+        return {key: finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite(item) for item in value]
+    return value
+
+
+extended = json.JSONEncoder(default=extended_default, allow_nan=False)
+plain = json.JSONEncoder(default=plain_default, allow_nan=False)
+
+
+def encode(encoder, value):
+    try:
+        return encoder.encode(value)
+    except ValueError:
+        # Raised for NaN and Infinity; only documents holding one get here
+        return encoder.encode(finite(value))
+
+# Documents encoded per chunk when a list is streamed
+STREAM_CHUNK = 100
+
+
+def dumps(value):
+    """Extended JSON for a catalog response."""
+    return encode(extended, value)
+
+
+def iter_list(items, encoder=extended, chunk=STREAM_CHUNK):
+    """Encode an iterable as a JSON array a chunk of documents at a time.
+
+    Nothing is held but the current chunk, so a cursor can be written out
+    as it is read.
+    """
+    yield "["
+    batch = []
+    first = True
+    for item in items:
+        batch.append(encode(encoder, item))
+        if len(batch) >= chunk:
+            yield ("" if first else ", ") + ", ".join(batch)
+            batch = []
+            first = False
+    if batch:
+        yield ("" if first else ", ") + ", ".join(batch)
+    yield "]"
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider with the plain encoding, so jsonify takes BSON values."""
+
+    default = staticmethod(plain_default)
+
+    def dumps(self, obj, **kwargs):
+        kwargs.setdefault("allow_nan", False)
+        try:
+            return super().dumps(obj, **kwargs)
+        except ValueError:
+            return super().dumps(finite(obj), **kwargs)
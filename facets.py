@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from snapshots import expired
+
+
+# Sidebar facets and the document value each one counts
+FACET_FIELDS = {
+    "category": "$category",
+    "brand": "$brand",
+    "model": "$model",
+    "state": {"$arrayElemAt": ["$location", 0]},
+    "condition": "$vehicle_condition",
+    "fuel_type": "$fuel_type",
+}
+
+# Lower bounds of the price buckets, in rupees
+PRICE_BOUNDARIES = [0, 500000, 1000000, 2000000, 3000000, 5000000, 10000000]
+
+
+def facet_pipeline(query):
+    """One aggregation returning every facet's counts for the matching vehicles."""
+    facets = {
+        name: [
+            {"$group": {"_id": value, "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+        ]
+        for name, value in FACET_FIELDS.items()
+    }
+    # cost is stored as the form sent it, so strings are converted and
+    # anything that isn't a price lands in the "unknown" bucket
+    facets["price"] = [{"$bucket": {
+        "groupBy": {"$convert": {"input": "$cost", "to": "double", "onError": None, "onNull": None}},
+        "boundaries": PRICE_BOUNDARIES + [float("inf")],
+        "default": "unknown",
+        "output": {"count": {"$sum": 1}},
+    }}]
+    facets["total"] = [{"$count": "count"}]
+    return [{"$match": query}, {"$facet": facets}]
+
+
+def facet_counts(result):
+    """Shape the $facet output for the frontend."""
+    result = result or {}
+    counts = {
+        name: [{"value": row["_id"], "count": row["count"]} for row in result.get(name, []) if row["_id"] not in (None, "")]
+        for name in FACET_FIELDS
+    }
+    upper = dict(zip(PRICE_BOUNDARIES, PRICE_BOUNDARIES[1:] + [None]))
+    counts["price"] = [
+        {"min": row["_id"], "max": upper.get(row["_id"]), "count": row["count"]} if row["_id"] != "unknown"
+        else {"min": None, "max": None, "count": row["count"]}
+        for row in result.get("price", [])
+    ]
+    total = result.get("total")
+    counts["total"] = total[0]["count"] if total else 0
+    return counts
+
+
+def filter_signature(query):
+    return json.dumps(query, sort_keys=True, default=str)
+
+
+class FacetCache:
+    """Encoded facet responses per filter signature.
+
+    Entries are dropped when the catalog changes, or once older than
+    max_age seconds (see snapshots.py).
+    """
+
+    def __init__(self, max_age=60, max_entries=1024):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # signature -> (stored_at, body)
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get(self, signature):
+        with self.lock:
+            entry = self.entries.get(signature)
+            if entry is None or expired(entry[0], self.max_age):
+                return None
+            self.entries.move_to_end(signature)
+            return entry[1]
+
+    def put(self, signature, version, body):
+        """Store a body computed at the given version, unless the catalog changed since."""
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[signature] = (time.monotonic(), body)
+            self.entries.move_to_end(signature)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
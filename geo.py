@@ -0,0 +1,53 @@
+import math
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def geo_point(lat, lon):
+    """GeoJSON point as stored on vehicles (note the lon, lat order)."""
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+class GeoGrid:
+    """Fixed-size lat/lon bucket grid for radius queries without a geo index.
+
+    Points are hashed into cells of cell_size degrees; a radius query only
+    measures the points in the cells overlapping the search circle's bounding
+    box.
+    """
+
+    def __init__(self, cell_size=0.5):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size))
+
+    def insert(self, key, lat, lon):
+        self.cells.setdefault(self.cell(lat, lon), []).append((key, lat, lon))
+
+    def within(self, lat, lon, radius_km):
+        """Keys within radius_km of (lat, lon), mapped to their distance."""
+        lat_span = radius_km / KM_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        lon_span = min(radius_km / (KM_PER_DEGREE * cos_lat), 180)
+        min_row, min_col = self.cell(lat - lat_span, lon - lon_span)
+        max_row, max_col = self.cell(lat + lat_span, lon + lon_span)
+
+        found = {}
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for key, point_lat, point_lon in self.cells.get((row, col), ()):
+                    distance = haversine_km(lat, lon, point_lat, point_lon)
+                    if distance <= radius_km:
+                        found[key] = distance
+        return found
@@ -0,0 +1,200 @@
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # resizing is skipped and originals are served instead
+    Image = None
+
+
+# Widths a client may ask for; anything else would let callers fill the cache
+VARIANT_WIDTHS = (160, 320, 640, 960, 1280)
+VARIANT_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png")}
+
+# Variants rendered in the background when a listing is created
+THUMBNAIL_VARIANTS = [(320, "webp"), (640, "webp")]
+
+
+def render_variant(source_path, width, fmt, quality=80):
+    """Resize an image to at most width pixels wide and re-encode it.  Runs in a worker process."""
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format=VARIANT_FORMATS[fmt][0], quality=quality)
+        return output.getvalue()
+
+
+class LRUBytes:
+    """Byte-budgeted LRU of rendered variants, in memory or in a directory."""
+
+    def __init__(self, budget, directory=None):
+        self.budget = budget
+        self.directory = directory
+        self.entries = OrderedDict()  # key -> bytes in memory, or size on disk
+        self.size = 0
+        self.lock = threading.Lock()
+        self.scanned = directory is None
+
+    def scan(self):
+        # Pick up variants written by earlier runs, oldest first
+        if os.path.isdir(self.directory):
+            files = sorted(os.scandir(self.directory), key=lambda entry: entry.stat().st_mtime)
+            for entry in files:
+                if entry.name.endswith(".tmp"):
+                    continue
+                self.entries[entry.name] = entry.stat().st_size
+                self.size += entry.stat().st_size
+        self.scanned = True
+
+    def __contains__(self, key):
+        with self.lock:
+            if not self.scanned:
+                self.scan()
+            return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            if not self.scanned:
+                self.scan()
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            if self.directory is None:
+                return self.entries[key]
+        try:
+            with open(os.path.join(self.directory, key), "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        if len(data) > self.budget:
+            return
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, key)
+            with open(path + ".tmp", "wb") as file:
+                file.write(data)
+            os.replace(path + ".tmp", path)
+        with self.lock:
+            if not self.scanned:
+                self.scan()
+            if key in self.entries:
+                self.size -= self.entry_size(self.entries.pop(key))
+            self.entries[key] = data if self.directory is None else len(data)
+            self.size += len(data)
+            while self.size > self.budget:
+                evicted, value = self.entries.popitem(last=False)
+                self.size -= self.entry_size(value)
+                if self.directory is not None:
+                    try:
+                        os.remove(os.path.join(self.directory, evicted))
+                    except OSError:
+                        pass
+
+    @staticmethod
+    def entry_size(value):
+        return value if isinstance(value, int) else len(value)
+
+
+class VariantCache:
+    """Resized upload images, rendered in a process pool and cached twice.
+
+    Lookups go memory -> disk -> render.  Concurrent requests for a variant
+    that is still rendering wait on the same job instead of starting another.
+    """
+
+    def __init__(self, directory, memory_budget, disk_budget, workers=2):
+        self.memory = LRUBytes(memory_budget)
+        self.disk = LRUBytes(disk_budget, directory)
+        self.workers = workers
+        self.executor = None
+        self.pending = {}
+        self.lock = threading.RLock()
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def pool(self):
+        # Created on first use, and spawned rather than forked: by then the
+        # process runs request and background threads a fork would copy
+        # mid-flight
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+            return self.executor
+
+    def discard(self, executor):
+        """Drop a pool that lost a worker, so the next render starts a new one."""
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, key, source_path, width, fmt):
+        """The future rendering a variant and the pool it runs on."""
+        with self.lock:
+            job = self.pending.get(key)
+            if job is None:
+                executor = self.pool()
+                try:
+                    future = executor.submit(render_variant, source_path, width, fmt)
+                except BrokenProcessPool:
+                    self.discard(executor)
+                    raise
+                job = self.pending[key] = (future, executor)
+                future.add_done_callback(lambda done: self.finish(key, done))
+            return job
+
+    def finish(self, key, future):
+        with self.lock:
+            self.pending.pop(key, None)
+        if future.exception() is None:
+            data = future.result()
+            self.disk.put(key, data)
+            self.memory.put(key, data)
+
+    def get(self, source_path, name, width, fmt, timeout=30):
+        """Bytes of the variant, rendering it if no cache has it.
+
+        Raises BrokenProcessPool when a render worker died; the pool is
+        replaced for the next request.
+        """
+        key = variant_key(name, width, fmt)
+        data = self.memory.get(key)
+        if data is None:
+            data = self.disk.get(key)
+            if data is not None:
+                self.memory.put(key, data)
+        if data is None:
+            future, executor = self.render(key, source_path, width, fmt)
+            try:
+                data = future.result(timeout)
+            except BrokenProcessPool:
+                self.discard(executor)
+                raise
+        return data
+
+    def prewarm(self, source_path, name, variants=THUMBNAIL_VARIANTS):
+        """Queue variants for rendering without waiting for them."""
+        if not self.available:
+            return
+        for width, fmt in variants:
+            key = variant_key(name, width, fmt)
+            if key not in self.disk:
+                self.render(key, source_path, width, fmt)
+
+
+def variant_key(name, width, fmt):
+    return f"{name}-w{width}.{fmt}"
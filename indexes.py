@@ -0,0 +1,69 @@
+from pymongo.errors import ConnectionFailure, PyMongoError
+
+
+# Compound indexes matching the filter combinations the frontend sends.  Each
+# one ends in the (created_at, _id) page order so a keyset page is an index
+# range scan.
+VEHICLE_INDEXES = [
+    [("to_show", 1), ("category_norm", 1), ("brand_norm", 1), ("model_norm", 1), ("created_at", -1), ("_id", -1)],
+    [("to_show", 1), ("brand_norm", 1), ("model_norm", 1), ("created_at", -1), ("_id", -1)],  # "Truck" skips the category filter
+    [("to_show", 1), ("state_norm", 1), ("created_at", -1), ("_id", -1)],
+    [("to_show", 1), ("condition_norm", 1), ("created_at", -1), ("_id", -1)],
+    [("to_show", 1), ("created_at", -1), ("_id", -1)],
+    [("to_show", 1), ("city_key", 1)],  # radius search without the geo index
+    [("geo", "2dsphere")],
+]
+
+INQUIRY_INDEXES = [
+    [("show", 1), ("created_at", -1), ("_id", -1)],
+    [("show", 1), ("status", 1), ("created_at", -1), ("_id", -1)],
+    [("vehicle_id", 1)],  # deleting a listing's inquiries
+]
+
+# mark_as_sold reads the records past the newest few per category in
+# sold_at order, and upserts on vehicle_id
+SOLD_INDEXES = [
+    ([("category", 1), ("sold_at", -1), ("_id", -1)], {}),
+    ([("vehicle_id", 1)], {"unique": True}),
+]
+
+# /api/stats matches a prefix of the dimensions and a day range
+ROLLUP_INDEXES = [
+    [("_id.category", 1), ("_id.brand", 1), ("_id.model", 1), ("_id.state", 1), ("_id.day", 1)],
+    [("_id.state", 1), ("_id.day", 1)],
+    [("_id.day", 1)],
+]
+
+# Shared rate limit buckets (RATE_LIMIT_BACKEND=mongo) expire an hour after
+# their last request
+RATE_LIMIT_INDEXES = [
+    ([("updated_at", 1)], {"expireAfterSeconds": 3600}),
+]
+
+
+def ensure_indexes(db):
+    """Create every index the app relies on; a no-op for ones that already exist.
+
+    Each index is created on its own, so one that fails (say, an existing
+    index with other options) is logged and the rest are still built.
+    Returns True when every index exists.
+    """
+    indexes = (
+        [("products", keys, {}) for keys in VEHICLE_INDEXES]
+        + [("inquiries", keys, {}) for keys in INQUIRY_INDEXES]
+        + [("sold_products", keys, options) for keys, options in SOLD_INDEXES]
+        + [("rate_limits", keys, options) for keys, options in RATE_LIMIT_INDEXES]
+        + [("listing_rollups", keys, {}) for keys in ROLLUP_INDEXES]
+    )
+    ensured = True
+    for name, keys, options in indexes:
+        try:
+            db[name].create_index(keys, **options)
+        except ConnectionFailure as e:
+            # Every other index would wait out the same timeout
+            print("Error ensuring indexes, Mongo is unreachable:", e)
+            return False
+        except PyMongoError as e:
+            print(f"Error creating index {keys} on {name}:", e)
+            ensured = False
+    return ensured
@@ -0,0 +1,244 @@
+"""Load and seed the PartsOnline database.
+
+    python loader.py locations [--file location.json]
+    python loader.py seed --products 10000 --inquiries 20000
+    python loader.py indexes
+
+Every command upserts by _id, so it can be re-run against a populated
+database.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId, json_util
+from pymongo import MongoClient, ReplaceOne
+
+from indexes import ensure_indexes
+from locations import LOCATION_FILE
+from vehicles import geo_fields, normalized_fields
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Catalog used for synthetic listings
+SYNTHETIC_CATALOG = {
+    "Medium Trucks": {
+        "Tata": ["LPK 2518", "LPT 1613", "1212 LPK", "2518 Tipper"],
+        "Ashok Leyland": ["1616", "2518", "2518i"],
+        "Bharat Benz": ["1617", "1623 Tipper", "3123"],
+        "Eicher": ["Pro 2049", "Pro 6000", "Pro 6025HT"],
+    },
+    "Light Trucks": {
+        "Tata": ["Ace", "Intra V10"],
+        "Mahindra": ["Bolero Pik-Up", "Scorpio Pik-Up", "Furio 7"],
+        "Isuzu": ["D-Max V-Cross", "NPR 400"],
+    },
+    "Heavy Trucks": {
+        "Volvo": ["FH 460"],
+        "Scania": ["R 500"],
+        "MAN": ["CLA 25.400"],
+        "Isuzu": ["Giga"],
+    },
+    "Bus": {
+        "Force": ["Traveller", "Trax"],
+        "Tata": ["Starbus"],
+    },
+}
+FUEL_TYPES = ["Diesel", "CNG", "Petrol", "Electric"]
+INQUIRY_STATUSES = ["Pending", "Evaluating", "Confirm", "Discard"]
+# Synthetic timestamps count back from a fixed point so re-seeding is a no-op
+SYNTHETIC_EPOCH = datetime(2025, 1, 1)
+
+
+def iter_json_array(file, chunk_size=1 << 16):
+    """Yield the items of a top-level JSON array without loading the whole file.
+
+    Items are decoded one at a time from a rolling buffer, with extended JSON
+    such as {"$oid": ...} turned into BSON types on the way.
+    """
+    decoder = json.JSONDecoder(object_hook=json_util.object_hook)
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number cut by the end of the buffer decodes too ("12" of
+                # "123", "1.5" of "1.5e3"), so an item only counts once a
+                # delimiter follows it; anything else waits for more input
+                after = end
+                while after < len(buffer) and buffer[after] in " \t\r\n":
+                    after += 1
+                if after < len(buffer) and buffer[after] in ",]":
+                    yield item
+                    pos = end
+                    continue
+                if eof:
+                    raise ValueError("Expected , or ] after an array item")
+        elif eof:
+            raise ValueError("Unexpected end of JSON array")
+
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def batched(documents, size):
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upsert_documents(collection, documents, batch_size=DEFAULT_BATCH_SIZE):
+    """Upsert documents by _id in unordered bulk writes and report throughput."""
+    started = time.perf_counter()
+    count = upserted = modified = 0
+    for batch in batched(documents, batch_size):
+        result = collection.bulk_write(
+            [ReplaceOne({"_id": document["_id"]}, document, upsert=True) for document in batch],
+            ordered=False,
+        )
+        count += len(batch)
+        upserted += result.upserted_count
+        modified += result.modified_count
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed else 0
+    print(f"{collection.name}: {count} documents ({upserted} inserted, {modified} updated) "
+          f"in {elapsed:.2f}s, {rate:.0f} docs/s")
+    return count
+
+
+def synthetic_id(kind, number):
+    """Stable ObjectId for the n-th synthetic document, so re-seeding overwrites it."""
+    return ObjectId(f"{kind:02x}{number:022x}")
+
+
+def synthetic_vehicles(count, rng, states):
+    categories = list(SYNTHETIC_CATALOG)
+    for number in range(count):
+        category = rng.choice(categories)
+        brand = rng.choice(list(SYNTHETIC_CATALOG[category]))
+        model = rng.choice(SYNTHETIC_CATALOG[category][brand])
+        state = rng.choice(states)
+        city = rng.choice(state["cities"])["name"] if state.get("cities") else None
+        phone = f"9{rng.randrange(10 ** 9):09d}"
+        vehicle = {
+            "_id": synthetic_id(1, number),
+            "user_info": {"name": f"Seller {number}", "phone": phone, "State": state["name"], "City": city},
+            "name": f"{brand} {model}",
+            "manufacture_year": rng.randint(2005, 2024),
+            "category": category,
+            "brand": brand,
+            "model": model,
+            "cost": rng.randrange(200000, 6000000, 5000),
+            "fuel_type": rng.choice(FUEL_TYPES),
+            "engine": {"type": "", "displacement": "", "power": "", "torque": ""},
+            "description": f"Well maintained {brand} {model}",
+            "thumbnail": f"https://gaadimarket.in/api/uploads/seed-{number}.jpg",
+            "image": [f"https://gaadimarket.in/api/uploads/seed-{number}.jpg"],
+            "documents": {},
+            "location": [state["name"], city],
+            "owners_number": rng.randint(1, 3),
+            "vehicle_condition": rng.choice(["Old", "New"]),
+            "body_type": "NA",
+            "engine_tech_type": "NA",
+            "to_show": rng.random() < 0.9,
+            "sold": False,
+            "created_at": SYNTHETIC_EPOCH - timedelta(minutes=rng.randrange(525600)),
+        }
+        vehicle.update(normalized_fields(vehicle))
+        vehicle.update(geo_fields(vehicle))
+        yield vehicle
+
+
+def synthetic_inquiries(count, vehicle_count, rng):
+    for number in range(count):
+        yield {
+            "_id": synthetic_id(2, number),
+            "name": f"Buyer {number}",
+            "vehicle_id": str(synthetic_id(1, rng.randrange(vehicle_count))),
+            "phone": f"8{rng.randrange(10 ** 9):09d}",
+            "email": f"buyer{number}@example.com",
+            "address": "NA",
+            "description": "Is this still available?",
+            "created_at": SYNTHETIC_EPOCH - timedelta(minutes=rng.randrange(525600)),
+            "show": rng.random() < 0.8,
+            "status": rng.choice(INQUIRY_STATUSES),
+        }
+
+
+def load_locations(db, path=LOCATION_FILE, batch_size=DEFAULT_BATCH_SIZE):
+    with open(path, "r") as file:
+        return upsert_documents(db["locations"], iter_json_array(file), batch_size)
+
+
+def seed(db, products, inquiries, batch_size=DEFAULT_BATCH_SIZE, random_seed=0):
+    """Write a synthetic catalog of the given size; the same seed gives the same data."""
+    rng = random.Random(random_seed)
+    with open(LOCATION_FILE, "r") as file:
+        states = list(iter_json_array(file))
+    upsert_documents(db["products"], synthetic_vehicles(products, rng, states), batch_size)
+    if inquiries and products:
+        upsert_documents(db["inquiries"], synthetic_inquiries(inquiries, products, rng), batch_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load and seed the PartsOnline database.")
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default=os.environ.get("MONGO_DB", "PartsOnline"))
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    locations = commands.add_parser("locations", help="upsert states and cities from location.json")
+    locations.add_argument("--file", default=LOCATION_FILE)
+
+    seed_parser = commands.add_parser("seed", help="upsert a synthetic products/inquiries dataset")
+    seed_parser.add_argument("--products", type=int, default=10000)
+    seed_parser.add_argument("--inquiries", type=int, default=0)
+    seed_parser.add_argument("--seed", type=int, default=0)
+
+    commands.add_parser("indexes", help="only ensure the indexes")
+
+    args = parser.parse_args(argv)
+    db = MongoClient(args.uri)[args.db]
+
+    if args.command == "locations":
+        load_locations(db, args.file, args.batch_size)
+    elif args.command == "seed":
+        seed(db, args.products, args.inquiries, args.batch_size, args.seed)
+
+    started = time.perf_counter()
+    if not ensure_indexes(db):
+        sys.exit("some indexes could not be created")
+    print(f"indexes ensured in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+from functools import lru_cache
+
+from geo import GeoGrid
+
+
+LOCATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "location.json")
+
+# Number of suggestions kept at every trie node
+MAX_SUGGESTIONS = 10
+
+
+def normalize_name(name):
+    return " ".join(name.lower().split())
+
+
+def city_key(state, city):
+    """Case-insensitive "state/city" key, as stored on vehicles."""
+    if not state or not city:
+        return None
+    return f"{normalize_name(state)}/{normalize_name(city)}"
+
+
+class LocationIndex:
+    """Read-only index of the states and cities shipped in location.json.
+
+    Everything is built once: the state list and every per-state city list are
+    stored already encoded as JSON, and the autocomplete trie keeps its top
+    suggestions at each node so a lookup is one walk down the query.
+    """
+
+    def __init__(self, states):
+        self.states = sorted(states, key=lambda state: state["name"])
+        self.states_json = json.dumps([state["name"] for state in self.states]).encode()
+        self.cities_json = {}
+        self.cities = {}  # city_key -> (state name, city document)
+        self.cities_by_name = {}  # normalized city name -> [city_key, ...]
+        self.grid = GeoGrid()
+        for state in self.states:
+            cities = state.get("cities", [])
+            city_list = [city["name"] for city in cities]
+            self.cities_json[state["name"]] = json.dumps({"state": state["name"], "city_list": city_list}).encode()
+            for city in cities:
+                key = city_key(state["name"], city["name"])
+                self.cities[key] = (state["name"], city)
+                self.cities_by_name.setdefault(normalize_name(city["name"]), []).append(key)
+                self.grid.insert(key, float(city["latitude"]), float(city["longitude"]))
+
+        self.trie = {}
+        for state in self.states:
+            self.insert(state["name"], {"type": "state", "name": state["name"]})
+            for city in state.get("cities", []):
+                self.insert(city["name"], {"type": "city", "name": city["name"], "state": state["name"]})
+        self.finish(self.trie)
+
+    def insert(self, name, entry):
+        # Index the name under every word so "mum" also suggests "Navi Mumbai"
+        words = normalize_name(name).split(" ")
+        for start in range(len(words)):
+            node = self.trie
+            for char in " ".join(words[start:]):
+                node = node.setdefault(char, {})
+                node.setdefault("", []).append(entry)
+
+    def finish(self, node):
+        # States rank above cities, then alphabetically; only the top few are kept
+        entries = node.get("")
+        if entries is not None:
+            unique = {(entry["type"], entry["name"], entry.get("state")): entry for entry in entries}
+            ranked = sorted(unique.values(), key=lambda entry: (entry["type"] != "state", entry["name"]))
+            node[""] = tuple(ranked[:MAX_SUGGESTIONS])
+        for char, child in node.items():
+            if char:
+                self.finish(child)
+
+    def state_list_json(self):
+        return self.states_json
+
+    def city_list_json(self, state):
+        """Encoded city list for a state, or None when the state is unknown."""
+        return self.cities_json.get(state)
+
+    def city(self, state, city):
+        """The location.json entry for a city, matched case-insensitively."""
+        found = self.cities.get(city_key(state, city))
+        return found[1] if found else None
+
+    def coordinates(self, state, city):
+        """(lat, lon) of a city, or None when it isn't in location.json."""
+        found = self.city(state, city)
+        if not found:
+            return None
+        return float(found["latitude"]), float(found["longitude"])
+
+    def find_city(self, name, state=None):
+        """Resolve a bare city name, preferring the given state when it is ambiguous."""
+        keys = self.cities_by_name.get(normalize_name(name), [])
+        if state:
+            keys = [key for key in keys if key == city_key(state, name)] or keys
+        if not keys:
+            return None
+        state_name, city = self.cities[keys[0]]
+        return state_name, city
+
+    def cities_within(self, lat, lon, radius_km):
+        """city_key -> distance in km for every city inside the radius."""
+        return self.grid.within(lat, lon, radius_km)
+
+    def suggest(self, query, limit=MAX_SUGGESTIONS):
+        node = self.trie
+        for char in normalize_name(query):
+            node = node.get(char)
+            if node is None:
+                return ()
+        return node.get("", ())[:limit]
+
+    @lru_cache(maxsize=4096)
+    def search_json(self, query, limit=MAX_SUGGESTIONS):
+        """Encoded suggestions for a normalized query, cached per query."""
+        return json.dumps(list(self.suggest(query, limit))).encode()
+
+
+location_index = None
+location_index_lock = threading.Lock()
+
+
+def get_location_index():
+    """Build the index on first use; it never changes afterwards."""
+    global location_index
+    if location_index is None:
+        with location_index_lock:
+            if location_index is None:
+                with open(LOCATION_FILE, "r") as file:
+                    location_index = LocationIndex(json.load(file))
+    return location_index
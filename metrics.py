@@ -0,0 +1,203 @@
+import threading
+import time
+from bisect import bisect_left
+
+from pymongo import monitoring
+
+
+# Upper bounds in seconds; requests and Mongo commands share them
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the shape Prometheus expects."""
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+def shape(value):
+    """A filter or pipeline with its values blanked, so similar queries log alike."""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shape(item) for item in value[:5]]
+    return "?"
+
+
+# Command fields that hold the part of a query worth logging
+SHAPE_FIELDS = ("filter", "pipeline", "sort", "query", "updates", "deletes")
+
+
+class Metrics:
+    """Request and Mongo command timings for one process.
+
+    Each gunicorn worker keeps its own numbers; Prometheus adds them up when
+    it scrapes every worker.
+    """
+
+    def __init__(self, slow_request_ms=None):
+        self.slow_request_ms = slow_request_ms
+        self.requests = {}  # (route, method, status) -> Histogram
+        self.request_mongo = {}  # route -> Histogram of Mongo time per request
+        self.commands = {}  # (command, collection, route) -> Histogram
+        self.documents = {}  # (command, collection) -> documents returned
+        self.failures = {}  # (command, collection) -> count
+        self.gauge_sources = []  # objects whose gauges() returns (name, help, value) rows
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start_request(self, route):
+        local = self.local
+        local.route = route
+        local.started = time.perf_counter()
+        local.mongo_seconds = 0.0
+        local.commands = [] if self.slow_request_ms else None
+
+    def finish_request(self, method, status):
+        local = self.local
+        started = getattr(local, "started", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        local.started = None
+        self.record_request(local.route, method, status, seconds, local.mongo_seconds)
+        if self.slow_request_ms and seconds * 1000 >= self.slow_request_ms:
+            print(f"Slow request: {method} {local.route} {status} {seconds * 1000:.1f}ms "
+                  f"(mongo {local.mongo_seconds * 1000:.1f}ms)")
+            for name, collection, command_seconds, documents, query_shape in local.commands:
+                print(f"    {name} {collection} {command_seconds * 1000:.1f}ms docs={documents} {query_shape}")
+
+    def record_request(self, route, method, status, seconds, mongo_seconds=0.0):
+        key = (route, method, status)
+        with self.lock:
+            histogram = self.requests.get(key)
+            if histogram is None:
+                histogram = self.requests[key] = Histogram()
+            histogram.observe(seconds)
+            histogram = self.request_mongo.get(route)
+            if histogram is None:
+                histogram = self.request_mongo[route] = Histogram()
+            histogram.observe(mongo_seconds)
+
+    def record_command(self, name, collection, seconds, documents, query_shape=None, failed=False):
+        local = self.local
+        route = getattr(local, "route", None) if getattr(local, "started", None) else None
+        route = route or "<background>"
+        key = (name, collection, route)
+        with self.lock:
+            histogram = self.commands.get(key)
+            if histogram is None:
+                histogram = self.commands[key] = Histogram()
+            histogram.observe(seconds)
+            if failed:
+                self.failures[(name, collection)] = self.failures.get((name, collection), 0) + 1
+            else:
+                self.documents[(name, collection)] = self.documents.get((name, collection), 0) + documents
+        if route != "<background>":
+            local.mongo_seconds += seconds
+            if local.commands is not None:
+                local.commands.append((name, collection, seconds, documents, query_shape))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self.lock:
+            requests = {key: (list(h.counts), h.total, h.count) for key, h in self.requests.items()}
+            request_mongo = {key: (list(h.counts), h.total, h.count) for key, h in self.request_mongo.items()}
+            commands = {key: (list(h.counts), h.total, h.count) for key, h in self.commands.items()}
+            documents = dict(self.documents)
+            failures = dict(self.failures)
+
+        lines = []
+        write_histograms(lines, "gaadimarket_request_seconds", "Time to handle a request",
+                         ("route", "method", "status"), requests)
+        write_histograms(lines, "gaadimarket_request_mongo_seconds", "Time a request spent waiting on Mongo",
+                         ("route",), {(route,): value for route, value in request_mongo.items()})
+        write_histograms(lines, "gaadimarket_mongo_command_seconds", "Time for Mongo to answer a command",
+                         ("command", "collection", "route"), commands)
+        lines.append("# HELP gaadimarket_mongo_documents_total Documents returned or written by Mongo commands")
+        lines.append("# TYPE gaadimarket_mongo_documents_total counter")
+        for (name, collection), count in sorted(documents.items()):
+            lines.append(f"gaadimarket_mongo_documents_total{labels(('command', 'collection'), (name, collection))} {count}")
+        lines.append("# HELP gaadimarket_mongo_command_failures_total Mongo commands that returned an error")
+        lines.append("# TYPE gaadimarket_mongo_command_failures_total counter")
+        for (name, collection), count in sorted(failures.items()):
+            lines.append(f"gaadimarket_mongo_command_failures_total{labels(('command', 'collection'), (name, collection))} {count}")
+        for source in self.gauge_sources:
+            for name, help_text, value in source.gauges():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def labels(names, values, extra=""):
+    pairs = [f"{name}={quote(value)}" for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+def quote(value):
+    return '"' + escape(value) + '"'
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def write_histograms(lines, name, help_text, label_names, histograms):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, (counts, total, count) in sorted(histograms.items(), key=lambda item: tuple(map(str, item[0]))):
+        cumulative = 0
+        for bound, bucket in zip(LATENCY_BUCKETS, counts):
+            cumulative += bucket
+            lines.append(f"{name}_bucket{labels(label_names, key, 'le=%s' % quote(bound))} {cumulative}")
+        lines.append(f"{name}_bucket{labels(label_names, key, 'le=%s' % quote('+Inf'))} {count}")
+        lines.append(f"{name}_sum{labels(label_names, key)} {total}")
+        lines.append(f"{name}_count{labels(label_names, key)} {count}")
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Feeds every Mongo command's duration and result size into Metrics.
+
+    pymongo calls these hooks on the thread that ran the command, so the
+    route being served is still in Metrics.local.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.pending = {}
+
+    def started(self, event):
+        # getMore names the cursor id first and the collection separately
+        collection = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        collection = collection if isinstance(collection, str) else ""
+        query_shape = None
+        if self.metrics.slow_request_ms:
+            query_shape = {field: shape(event.command[field]) for field in SHAPE_FIELDS if field in event.command}
+        self.pending[(event.connection_id, event.request_id)] = (collection, query_shape)
+
+    def succeeded(self, event):
+        collection, query_shape = self.pending.pop((event.connection_id, event.request_id), ("", None))
+        reply = event.reply
+        cursor = reply.get("cursor")
+        if cursor:
+            documents = len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+        else:
+            documents = reply.get("n", 0)
+        self.metrics.record_command(event.command_name, collection, event.duration_micros / 1e6, documents, query_shape)
+
+    def failed(self, event):
+        collection, query_shape = self.pending.pop((event.connection_id, event.request_id), ("", None))
+        self.metrics.record_command(event.command_name, collection, event.duration_micros / 1e6, 0, query_shape, failed=True)
@@ -0,0 +1,102 @@
+import os
+import threading
+
+from pymongo import MongoClient
+from pymongo.read_preferences import read_pref_mode_from_name, make_read_preference
+
+
+def env_int(env, name, default):
+    value = env.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def load_config(env=None):
+    """Mongo settings from the environment, with the previous hard-coded values as defaults."""
+    env = os.environ if env is None else env
+    return {
+        "MONGO_URI": env.get("MONGO_URI", "mongodb://localhost:27017"),
+        "MONGO_DB": env.get("MONGO_DB", "PartsOnline"),
+        "MONGO_MAX_POOL_SIZE": env_int(env, "MONGO_MAX_POOL_SIZE", 100),
+        "MONGO_MIN_POOL_SIZE": env_int(env, "MONGO_MIN_POOL_SIZE", 0),
+        "MONGO_CONNECT_TIMEOUT_MS": env_int(env, "MONGO_CONNECT_TIMEOUT_MS", 5000),
+        "MONGO_SERVER_SELECTION_TIMEOUT_MS": env_int(env, "MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+        "MONGO_SOCKET_TIMEOUT_MS": env_int(env, "MONGO_SOCKET_TIMEOUT_MS", None),
+        "MONGO_WAIT_QUEUE_TIMEOUT_MS": env_int(env, "MONGO_WAIT_QUEUE_TIMEOUT_MS", None),
+        "MONGO_READ_PREFERENCE": env.get("MONGO_READ_PREFERENCE", "primary"),
+        # e.g. "secondaryPreferred" to send public catalog reads to replicas
+        "MONGO_CATALOG_READ_PREFERENCE": env.get("MONGO_CATALOG_READ_PREFERENCE", ""),
+    }
+
+
+class MongoConnection:
+    """One MongoClient per process, created on first use.
+
+    MongoClient is not fork-safe, so a client inherited from a parent process
+    (gunicorn --preload) is discarded and a new one is made in the child.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or load_config()
+        self.client = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.listeners = []
+
+    def configure(self, config):
+        with self.lock:
+            self.config = config
+            self.client = None
+
+    def use(self, client):
+        """Serve every collection from an existing client, e.g. an in-process stand-in."""
+        with self.lock:
+            self.client = client
+            self.pid = os.getpid()
+
+    def get_client(self):
+        if self.client is None or self.pid != os.getpid():
+            with self.lock:
+                if self.client is None or self.pid != os.getpid():
+                    config = self.config
+                    self.client = MongoClient(
+                        config["MONGO_URI"],
+                        maxPoolSize=config["MONGO_MAX_POOL_SIZE"],
+                        minPoolSize=config["MONGO_MIN_POOL_SIZE"],
+                        connectTimeoutMS=config["MONGO_CONNECT_TIMEOUT_MS"],
+                        serverSelectionTimeoutMS=config["MONGO_SERVER_SELECTION_TIMEOUT_MS"],
+                        socketTimeoutMS=config["MONGO_SOCKET_TIMEOUT_MS"],
+                        waitQueueTimeoutMS=config["MONGO_WAIT_QUEUE_TIMEOUT_MS"],
+                        readPreference=config["MONGO_READ_PREFERENCE"],
+                        event_listeners=self.listeners,
+                    )
+                    self.pid = os.getpid()
+        return self.client
+
+    def database(self):
+        return self.get_client()[self.config["MONGO_DB"]]
+
+
+class LazyCollection:
+    """Stands in for a pymongo Collection until the first call needs the client."""
+
+    def __init__(self, connection, name, read_preference_key=None):
+        self.connection = connection
+        self.name = name
+        self.read_preference_key = read_preference_key
+        self.resolved = None
+
+    def resolve(self):
+        client = self.connection.get_client()
+        resolved = self.resolved
+        if resolved is None or resolved[0] is not client:
+            collection = self.connection.database()[self.name]
+            mode = self.read_preference_key and self.connection.config.get(self.read_preference_key)
+            if mode:
+                collection = collection.with_options(
+                    read_preference=make_read_preference(read_pref_mode_from_name(mode), None)
+                )
+            resolved = self.resolved = (client, collection)
+        return resolved[1]
+
+    def __getattr__(self, attribute):
+        return getattr(self.resolve(), attribute)
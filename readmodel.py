@@ -0,0 +1,241 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from encoding import dumps
+from snapshots import Snapshot
+from vehicles import NORMALIZED_FIELDS
+
+
+# READ_MODEL=1 serves the public listing routes from memory
+READ_MODEL = os.environ.get("READ_MODEL", "").lower() in ("1", "true", "yes")
+
+# Filter fields the read model indexes; a query on anything else goes to Mongo
+INDEXED_FIELDS = tuple(NORMALIZED_FIELDS.values())
+
+# Sort key for the odd listing saved without created_at
+OLDEST = datetime.min
+
+# Seconds to wait before reopening a change stream that failed
+RESUME_DELAY = 5
+
+
+class Listing:
+    """One visible listing: its page sort key, filter values and encoded responses."""
+
+    __slots__ = ("key", "card", "detail", "size", *INDEXED_FIELDS)
+
+    def __init__(self, vehicle, card, detail):
+        self.key = (vehicle.get("created_at") or OLDEST, vehicle["_id"])
+        self.card = dumps(card)
+        self.detail = dumps(detail)
+        for field in INDEXED_FIELDS:
+            setattr(self, field, vehicle.get(field))
+        # The record, its strings and key, and a pointer from each list it sits in
+        postings = sum(1 for field in INDEXED_FIELDS if getattr(self, field) is not None)
+        self.size = (sys.getsizeof(self) + sys.getsizeof(self.card) + sys.getsizeof(self.detail)
+                     + sys.getsizeof(self.key) + 8 * (2 + postings))
+
+
+class Listings:
+    """The visible listings, newest first overall and per filter value."""
+
+    def __init__(self):
+        self.records = {}  # _id -> Listing
+        self.order = []  # every key, ascending
+        self.postings = {field: {} for field in INDEXED_FIELDS}  # field -> value -> ascending keys
+        self.bytes = 0
+
+    def add(self, record):
+        self.remove(record.key[1])
+        self.records[record.key[1]] = record
+        insort(self.order, record.key)
+        for field in INDEXED_FIELDS:
+            value = getattr(record, field)
+            if value is not None:
+                insort(self.postings[field].setdefault(value, []), record.key)
+        self.bytes += record.size
+
+    def remove(self, vehicle_id):
+        record = self.records.pop(vehicle_id, None)
+        if record is None:
+            return
+        discard(self.order, record.key)
+        for field in INDEXED_FIELDS:
+            value = getattr(record, field)
+            if value is not None:
+                keys = self.postings[field][value]
+                discard(keys, record.key)
+                if not keys:
+                    del self.postings[field][value]
+        self.bytes -= record.size
+
+    def page(self, filters, after=None, limit=None):
+        """Matching records newest first, from the smallest posting list that covers the filter."""
+        keys = self.order
+        for field, value in filters.items():
+            candidate = self.postings[field].get(value, ())
+            if len(candidate) < len(keys):
+                keys = candidate
+        position = bisect_left(keys, after) if after else len(keys)
+        matched = []
+        while position > 0 and (limit is None or len(matched) <= limit):
+            position -= 1
+            record = self.records[keys[position][1]]
+            if all(getattr(record, field) == value for field, value in filters.items()):
+                matched.append(record)
+        return matched
+
+
+def discard(keys, key):
+    position = bisect_left(keys, key)
+    if position < len(keys) and keys[position] == key:
+        del keys[position]
+
+
+class ReadModel(Snapshot):
+    """The visible listings held in this process, behind GET /api/vehicles and /api/vehicles/<id>.
+
+    Each listing keeps its card and detail responses already encoded, so a
+    page is a join of strings.  Loaded in the background at startup; until
+    then, and for filters it does not index, the routes read from Mongo.
+    Where Mongo has change streams every worker tails one and stays within
+    the stream's lag of the database; otherwise it is rebuilt once older
+    than max_age (see snapshots.py).
+    """
+
+    name = "read model"
+
+    def __init__(self, collection, primary, card, detail, max_age=300):
+        super().__init__(max_age)
+        self.collection = collection  # loads, which may read a secondary
+        self.primary = primary  # refreshes after a write, which must see it
+        self.card = card
+        self.detail = detail
+        self.streaming = False
+        self.change_lag = None  # seconds between the last change and applying it
+
+    def record(self, vehicle):
+        return Listing(vehicle, self.card(vehicle), self.detail(vehicle))
+
+    def build(self):
+        listings = Listings()
+        for vehicle in self.collection.find({"to_show": True}):
+            listings.add(self.record(vehicle))
+        return listings
+
+    def apply(self, listings, change):
+        vehicle_id, record = change
+        if record is None:
+            listings.remove(vehicle_id)
+        else:
+            listings.add(record)
+
+    def start(self):
+        """Load in the background and start following the change stream."""
+        if self.started:
+            return
+        super().start()
+        threading.Thread(target=self.follow, daemon=True).start()
+
+    def stale(self):
+        # A change stream keeps the model current without rebuilds
+        return not self.streaming and super().stale()
+
+    def follow(self):
+        resume_after = None
+        while True:
+            try:
+                with self.collection.watch(full_document="updateLookup", resume_after=resume_after) as stream:
+                    self.streaming = True
+                    for change in stream:
+                        resume_after = change["_id"]
+                        self.changed(change)
+            except OperationFailure as e:
+                if not self.streaming:
+                    # A standalone mongod has no change streams
+                    print("Change streams unavailable, the read model follows this process's writes:", e)
+                    return
+                print("Read model change stream failed, reloading:", e)
+                self.streaming = False
+                resume_after = None
+                self.reload_in_background()
+            except PyMongoError as e:
+                print("Read model change stream failed, retrying:", e)
+                if self.streaming:
+                    self.streaming = False
+                    resume_after = None
+                    self.reload_in_background()
+            time.sleep(RESUME_DELAY)
+
+    def changed(self, change):
+        vehicle_id = change.get("documentKey", {}).get("_id")
+        if vehicle_id is None:
+            return
+        self.update(vehicle_id, change.get("fullDocument"))
+        cluster_time = change.get("clusterTime")
+        if cluster_time is not None:
+            self.change_lag = max(0.0, time.time() - cluster_time.time)
+
+    def update(self, vehicle_id, vehicle):
+        record = self.record(vehicle) if vehicle and vehicle.get("to_show") else None
+        self.report((vehicle_id, record))
+
+    def refresh(self, ids):
+        """Re-read listings a write endpoint changed, so this process sees its own writes at once."""
+        if self.current is None and not self.reloading:
+            return
+        ids = [ObjectId(str(vehicle_id)) for vehicle_id in ids]
+        found = {vehicle["_id"]: vehicle for vehicle in self.primary.find({"_id": {"$in": ids}})}
+        for vehicle_id in ids:
+            self.update(vehicle_id, found.get(vehicle_id))
+
+    def page(self, query, after=None, limit=None):
+        """Encoded cards for a build_vehicle_query filter and the key to resume after, or None to ask Mongo."""
+        filters = {field: value for field, value in query.items() if field != "to_show"}
+        if query.get("to_show") is not True or not set(filters) <= set(INDEXED_FIELDS):
+            return None
+        listings = self.get(wait=False)
+        if listings is None:
+            return None
+        with self.lock:
+            records = listings.page(filters, after, limit)
+        next_key = records[limit - 1].key if limit and len(records) > limit else None
+        return [record.card for record in records[:limit]], next_key
+
+    def vehicle(self, vehicle_id):
+        """The encoded detail of a visible listing, or None to ask Mongo."""
+        listings = self.get(wait=False)
+        if listings is None:
+            return None
+        record = listings.records.get(vehicle_id)
+        return record.detail if record else None
+
+    def gauges(self):
+        listings = self.current
+        count = len(listings.records) if listings else 0
+        size = listings.bytes if listings else 0
+        if self.streaming:
+            staleness = self.change_lag or 0.0
+        else:
+            staleness = self.max_age
+        return [
+            ("gaadimarket_read_model_listings", "Listings held in the read model", count),
+            ("gaadimarket_read_model_bytes", "Approximate memory held by the read model", size),
+            ("gaadimarket_read_model_bytes_per_listing", "Approximate read model memory per listing",
+             size / count if count else 0),
+            ("gaadimarket_read_model_age_seconds", "Seconds since the read model was loaded",
+             time.monotonic() - self.loaded_at if listings else 0),
+            ("gaadimarket_read_model_change_stream", "1 while the read model follows a change stream",
+             1 if self.streaming else 0),
+            ("gaadimarket_read_model_staleness_seconds",
+             "Bound on how far behind Mongo the read model can be: the change stream lag, else max_age",
+             staleness),
+        ]
+
@@ -0,0 +1,69 @@
+import os
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from taxonomy import TAXONOMY_FIELDS
+
+
+# Sold listings kept per category; older ones are deleted with their inquiries
+SOLD_RETENTION = int(os.environ.get("SOLD_RETENTION", 4))
+
+# Most listings one sale evicts, so a backlog of old sold records drains a
+# batch at a time instead of making a single sale slow
+EVICTION_BATCH = 50
+
+
+class SoldRetention:
+    """Marks listings sold and keeps the newest `keep` sold listings per category.
+
+    Each step is idempotent and they run in an order that makes a failed
+    request safe to retry: the sold record is upserted on vehicle_id first,
+    then the listing and inquiry flags are set, and eviction deletes the
+    sold records last.  Eviction reads only the records past the newest
+    `keep` through the (category, sold_at) index, so a sale costs the same
+    however many sold records its category has.
+    """
+
+    def __init__(self, products, inquiries, sold, keep=SOLD_RETENTION, batch=EVICTION_BATCH):
+        self.products = products
+        self.inquiries = inquiries
+        self.sold = sold
+        self.keep = keep
+        self.batch = batch
+
+    def mark_sold(self, vehicle_id, inquiry_id, category):
+        """Record the sale and evict old ones; returns (newly sold, evicted listings)."""
+        result = self.sold.update_one(
+            {"vehicle_id": vehicle_id},
+            {"$setOnInsert": {
+                "vehicle_id": vehicle_id,
+                "inquiry_id": inquiry_id,
+                "category": category,
+                "sold_at": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
+        self.products.update_one({"_id": ObjectId(vehicle_id)}, {"$set": {"sold": True}})
+        self.inquiries.update_one({"_id": ObjectId(inquiry_id)}, {"$set": {"show": False}})
+        return result.upserted_id is not None, self.evict(category)
+
+    def evict(self, category):
+        """Delete the sold listings past the newest `keep`, with their inquiries."""
+        stale = list(
+            self.sold.find({"category": category}, {"vehicle_id": 1})
+            .sort([("sold_at", -1), ("_id", -1)])
+            .skip(self.keep)
+            .limit(self.batch)
+        )
+        if not stale:
+            return []
+
+        vehicle_ids = [record["vehicle_id"] for record in stale]
+        object_ids = [ObjectId(vehicle_id) for vehicle_id in vehicle_ids if ObjectId.is_valid(vehicle_id)]
+        # Read first so the caller can update its caches for what is deleted
+        evicted = list(self.products.find({"_id": {"$in": object_ids}}, TAXONOMY_FIELDS))
+        self.products.delete_many({"_id": {"$in": object_ids}})
+        self.inquiries.delete_many({"vehicle_id": {"$in": vehicle_ids}})
+        self.sold.delete_many({"_id": {"$in": [record["_id"] for record in stale]}})
+        return evicted
@@ -0,0 +1,265 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import PyMongoError
+
+from vehicles import normalize
+
+
+# Fields a write endpoint must read for the rollups
+ROLLUP_FIELDS = {"category": 1, "brand": 1, "model": 1, "location": 1, "cost": 1}
+
+# Dimensions of a rollup document, besides its day
+DIMENSIONS = ("category", "brand", "model", "state")
+
+# Counters kept per rollup document
+EVENTS = ("listed", "shown", "sold")
+
+# Relative error of the price quantiles.  Prices land in logarithmic
+# buckets, so sketches from any set of rollup documents merge by adding
+# their bucket counts.
+SKETCH_ACCURACY = 0.02
+GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+
+QUANTILES = {"p25": 0.25, "p50": 0.5, "p75": 0.75, "p90": 0.9}
+
+# Longest time range /api/stats reads
+MAX_RANGE_DAYS = 366
+
+
+def parse_price(value):
+    """The cost as the form sent it, as a positive number, or None."""
+    if isinstance(value, str):
+        value = value.replace(",", "").strip()
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        return None
+    return price if price > 0 and math.isfinite(price) else None
+
+
+def sketch_index(price):
+    return math.ceil(math.log(price, GAMMA))
+
+
+def sketch_value(index):
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+def dimensions(vehicle):
+    location = vehicle.get("location") or []
+    return {
+        "category": vehicle.get("category"),
+        "brand": vehicle.get("brand"),
+        "model": vehicle.get("model"),
+        "state": location[0] if location else None,
+    }
+
+
+def day_of(moment):
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def rollup_key(vehicle, day):
+    # Matched on the normalized values, so "TATA" and "Tata" share a rollup
+    key = {name: normalize(value) for name, value in dimensions(vehicle).items()}
+    key["day"] = day
+    return key
+
+
+class Rollups:
+    """Listing, approval and sale counts and asking-price sketches per
+    (category, brand, model, state, day), kept in the listing_rollups
+    collection.
+
+    The write endpoints add to them as they go, with an upsert per rollup
+    touched, so /api/stats reads the documents for its range and never the
+    listings.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def record(self, event, vehicles, price=True):
+        """Count one event for each vehicle, with its asking price unless price is False.
+
+        Vehicles sharing a rollup are combined, so a batch costs one upsert
+        per rollup it touches.  A failure is logged rather than raised: the
+        write the event describes has already happened.
+        """
+        day = day_of(datetime.utcnow())
+        prefix = "sold_price" if event == "sold" else "price"
+        updates = {}
+        for vehicle in vehicles:
+            key = rollup_key(vehicle, day)
+            update = updates.get(tuple(key.values()))
+            if update is None:
+                update = updates[tuple(key.values())] = (key, {
+                    "$inc": defaultdict(int),
+                    "$setOnInsert": {"names": dimensions(vehicle)},
+                })
+            inc = update[1]["$inc"]
+            inc[event] += 1
+            amount = parse_price(vehicle.get("cost")) if price else None
+            if amount is not None:
+                inc[f"{prefix}.count"] += 1
+                inc[f"{prefix}.sum"] += amount
+                inc[f"{prefix}.sketch.{sketch_index(amount)}"] += 1
+                low = update[1].setdefault("$min", {}).get(f"{prefix}.min", amount)
+                high = update[1].setdefault("$max", {}).get(f"{prefix}.max", amount)
+                update[1]["$min"][f"{prefix}.min"] = min(low, amount)
+                update[1]["$max"][f"{prefix}.max"] = max(high, amount)
+        if not updates:
+            return
+        try:
+            self.collection.bulk_write([
+                UpdateOne({"_id": key}, {**update, "$inc": dict(update["$inc"])}, upsert=True)
+                for key, update in updates.values()
+            ], ordered=False)
+        except PyMongoError as e:
+            print("Error updating rollups:", e)
+
+    def listed(self, vehicles):
+        self.record("listed", vehicles, price=False)
+
+    def shown(self, vehicle):
+        self.record("shown", [vehicle])
+
+    def sold(self, vehicle):
+        self.record("sold", [vehicle])
+
+    def query(self, filters, start, end, group_by):
+        """Totals and price quantiles per group for rollups in [start, end)."""
+        match = {f"_id.{name}": normalize(value) for name, value in filters.items()}
+        match["_id.day"] = {"$gte": start, "$lt": end}
+        groups = {}
+        for rollup in self.collection.find(match):
+            group = tuple(group_value(rollup, name) for name in group_by)
+            totals = groups.get(group)
+            if totals is None:
+                totals = groups[group] = new_totals()
+            add_totals(totals, rollup)
+        rows = []
+        for group, totals in sorted(groups.items(), key=lambda item: tuple(map(str, item[0]))):
+            row = dict(zip(group_by, group))
+            row.update({event: totals[event] for event in EVENTS})
+            row["price"] = price_summary(totals["price"])
+            row["sold_price"] = price_summary(totals["sold_price"])
+            rows.append(row)
+        return rows
+
+    def rebuild(self, products, sold_products):
+        """Recompute every rollup from the listings and sold records; returns the number written.
+
+        Listings have no approval date, so a visible listing counts as
+        shown on the day it was created.
+        """
+        rollups = {}
+
+        def add(event, vehicle, moment, price=True):
+            day = day_of(moment or datetime.utcnow())
+            key = rollup_key(vehicle, day)
+            rollup = rollups.get(tuple(key.values()))
+            if rollup is None:
+                rollup = rollups[tuple(key.values())] = {"_id": key, "names": dimensions(vehicle), **new_totals()}
+            rollup[event] += 1
+            amount = parse_price(vehicle.get("cost")) if price else None
+            if amount is not None:
+                add_price(rollup["sold_price" if event == "sold" else "price"], amount)
+
+        fields = {"category": 1, "brand": 1, "model": 1, "location": 1, "cost": 1, "created_at": 1, "to_show": 1}
+        vehicles = {}
+        for vehicle in products.find({}, fields):
+            vehicles[str(vehicle["_id"])] = vehicle
+            add("listed", vehicle, vehicle.get("created_at"), price=False)
+            if vehicle.get("to_show"):
+                add("shown", vehicle, vehicle.get("created_at"))
+        for record in sold_products.find({}, {"vehicle_id": 1, "sold_at": 1}):
+            vehicle = vehicles.get(record["vehicle_id"])
+            if vehicle:
+                add("sold", vehicle, record.get("sold_at"))
+
+        self.collection.delete_many({})
+        batch = []
+        for rollup in rollups.values():
+            for prefix in ("price", "sold_price"):
+                rollup[prefix]["sketch"] = {str(index): count for index, count in rollup[prefix]["sketch"].items()}
+                if not rollup[prefix]["count"]:
+                    del rollup[prefix]
+            batch.append(ReplaceOne({"_id": rollup["_id"]}, rollup, upsert=True))
+            if len(batch) == 1000:
+                self.collection.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            self.collection.bulk_write(batch, ordered=False)
+        return len(rollups)
+
+
+def group_value(rollup, name):
+    if name == "day":
+        return rollup["_id"]["day"]
+    if name == "week":
+        day = rollup["_id"]["day"]
+        return day - timedelta(days=day.weekday())
+    # Shown as first written, rather than the lowercase key
+    return (rollup.get("names") or {}).get(name) or rollup["_id"].get(name)
+
+
+def new_totals():
+    return {
+        **{event: 0 for event in EVENTS},
+        "price": new_price(),
+        "sold_price": new_price(),
+    }
+
+
+def new_price():
+    return {"count": 0, "sum": 0.0, "min": None, "max": None, "sketch": defaultdict(int)}
+
+
+def add_price(totals, amount):
+    totals["count"] += 1
+    totals["sum"] += amount
+    totals["min"] = amount if totals["min"] is None else min(totals["min"], amount)
+    totals["max"] = amount if totals["max"] is None else max(totals["max"], amount)
+    totals["sketch"][sketch_index(amount)] += 1
+
+
+def add_totals(totals, rollup):
+    for event in EVENTS:
+        totals[event] += rollup.get(event, 0)
+    for prefix in ("price", "sold_price"):
+        price = rollup.get(prefix)
+        if not price or not price.get("count"):
+            continue
+        merged = totals[prefix]
+        merged["count"] += price["count"]
+        merged["sum"] += price["sum"]
+        merged["min"] = price["min"] if merged["min"] is None else min(merged["min"], price["min"])
+        merged["max"] = price["max"] if merged["max"] is None else max(merged["max"], price["max"])
+        for index, count in price.get("sketch", {}).items():
+            merged["sketch"][int(index)] += count
+
+
+def price_summary(totals):
+    if not totals["count"]:
+        return None
+    summary = {
+        "count": totals["count"],
+        "mean": round(totals["sum"] / totals["count"]),
+        "min": totals["min"],
+        "max": totals["max"],
+    }
+    buckets = sorted(totals["sketch"].items())
+    for name, fraction in QUANTILES.items():
+        rank = fraction * (totals["count"] - 1)
+        seen = 0
+        for index, count in buckets:
+            seen += count
+            if seen > rank:
+                # Clamped so a quantile never leaves the observed range
+                summary[name] = round(min(max(sketch_value(index), totals["min"]), totals["max"]))
+                break
+    return summary
@@ -0,0 +1,341 @@
+import heapq
+import math
+from bisect import bisect_left, insort
+from operator import itemgetter
+import re
+
+from snapshots import Snapshot
+
+
+# Searchable fields and how much a term found in each one counts
+SEARCH_WEIGHTS = {"name": 3.0, "brand": 3.0, "model": 3.0, "body_type": 1.0, "description": 1.0, "features": 1.0}
+SEARCH_FIELDS = {field: 1 for field in SEARCH_WEIGHTS}
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Terms this short are only matched exactly; longer ones also match one typo away
+MIN_FUZZY_LENGTH = 4
+FUZZY_PENALTY = 0.6
+
+# Posting lists longer than this share of the listings (and DENSE_MIN) are
+# read best weight first and only as far as the page needs
+DENSE_SHARE = 0.005
+DENSE_MIN = 1000
+# Common terms that rarely appear together never let the walk stop early;
+# past this depth the remaining listings score within a hair of each other
+MAX_DEPTH = 2000
+# Listings with every common term are scored up front when there are at
+# most this many; past that only they are walked
+CONJUNCTIVE_MAX = 5000
+# Terms in more than this share of the listings aren't walked at all
+STOPWORD_SHARE = 0.5
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def field_text(value):
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(item) for item in value if item is not None)
+    return str(value) if value is not None else ""
+
+
+def deletions(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def within_one_edit(a, b):
+    """True if a and b differ by one insertion, deletion, substitution or swap."""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        return len(diffs) == 2 and diffs[1] == diffs[0] + 1 and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]
+    if len(a) > len(b):
+        a, b = b, a
+    return any(a == b[:i] + b[i + 1:] for i in range(len(b)))
+
+
+class InvertedIndex:
+    """BM25 postings for the visible listings.
+
+    Each posting stores the term's length-normalised weight for one listing,
+    computed when the listing is indexed, so a query only multiplies by idf
+    and adds up.  Typos are matched through a table of every vocabulary term
+    with one letter deleted (the symmetric delete method).
+
+    Rare terms are scored by walking their postings.  Common terms are read
+    from a copy sorted by weight, best first, and the walk stops once no
+    listing further down can beat the page (Fagin's threshold algorithm), so
+    a query for "tata" doesn't score every Tata listing.  When many listings
+    have every common term, only they are walked, so those rank first.
+    """
+
+    def __init__(self):
+        self.postings = {}  # term -> {doc: weight}
+        self.doc_ids = []  # doc -> listing id, None once removed
+        self.doc_terms = []  # doc -> terms, to undo its postings
+        self.docs = {}  # listing id -> doc
+        self.free = []
+        self.total_length = 0
+        self.doc_lengths = []
+        self.deletes = {}  # term with one letter deleted -> terms
+        self.ranked = {}  # term -> [(-weight, doc)], kept for common terms once queried
+
+    def field_terms(self, vehicle):
+        frequencies = {}
+        length = 0
+        for field, weight in SEARCH_WEIGHTS.items():
+            terms = tokenize(field_text(vehicle.get(field)))
+            length += len(terms)
+            for term in terms:
+                frequencies[term] = frequencies.get(term, 0) + weight
+        return frequencies, length
+
+    def add(self, vehicle_id, vehicle):
+        self.remove(vehicle_id)
+        frequencies, length = self.field_terms(vehicle)
+        doc = self.free.pop() if self.free else len(self.doc_ids)
+        if doc == len(self.doc_ids):
+            self.doc_ids.append(None)
+            self.doc_terms.append(())
+            self.doc_lengths.append(0)
+        self.doc_ids[doc] = vehicle_id
+        self.doc_terms[doc] = tuple(frequencies)
+        self.doc_lengths[doc] = length
+        self.docs[vehicle_id] = doc
+        self.total_length += length
+
+        average = self.total_length / len(self.docs)
+        norm = K1 * (1 - B + B * length / average) if average else K1
+        for term, frequency in frequencies.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                if len(term) >= MIN_FUZZY_LENGTH:
+                    for deleted in deletions(term):
+                        self.deletes.setdefault(deleted, set()).add(term)
+            weight = posting[doc] = frequency * (K1 + 1) / (frequency + norm)
+            ranked = self.ranked.get(term)
+            if ranked is not None:
+                insort(ranked, (-weight, doc))
+
+    def remove(self, vehicle_id):
+        doc = self.docs.pop(vehicle_id, None)
+        if doc is None:
+            return
+        for term in self.doc_terms[doc]:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            weight = posting.pop(doc, None)
+            ranked = self.ranked.get(term)
+            if ranked is not None and weight is not None:
+                del ranked[bisect_left(ranked, (-weight, doc))]
+            if not posting:
+                del self.postings[term]
+                self.ranked.pop(term, None)
+                if len(term) >= MIN_FUZZY_LENGTH:
+                    for deleted in deletions(term):
+                        similar = self.deletes.get(deleted)
+                        if similar:
+                            similar.discard(term)
+                            if not similar:
+                                del self.deletes[deleted]
+        self.total_length -= self.doc_lengths[doc]
+        self.doc_ids[doc] = None
+        self.doc_terms[doc] = ()
+        self.free.append(doc)
+
+    def expand(self, term):
+        """The term itself if indexed, else indexed terms one typo away, with their weight."""
+        if term in self.postings:
+            return [(term, 1.0)]
+        if len(term) < MIN_FUZZY_LENGTH:
+            return []
+        candidates = set(self.deletes.get(term, ()))
+        for deleted in deletions(term):
+            if deleted in self.postings:
+                candidates.add(deleted)
+            candidates.update(self.deletes.get(deleted, ()))
+        return [(candidate, FUZZY_PENALTY) for candidate in candidates if within_one_edit(term, candidate)]
+
+    def dense_size(self):
+        return max(DENSE_MIN, int(len(self.docs) * DENSE_SHARE))
+
+    def rank_common_terms(self):
+        """Sort the common terms' postings up front so no query pays for it."""
+        dense = self.dense_size()
+        for term, posting in self.postings.items():
+            if len(posting) > dense:
+                self.ranked_posting(term)
+
+    def ranked_posting(self, term):
+        ranked = self.ranked.get(term)
+        if ranked is None:
+            ranked = self.ranked[term] = sorted((-weight, doc) for doc, weight in self.postings[term].items())
+        return ranked
+
+    def search(self, query, limit, offset=0):
+        """Listing ids ranked by BM25 score, best first."""
+        count = len(self.docs)
+        terms = {}
+        for term in dict.fromkeys(tokenize(query)):
+            for indexed, weight in self.expand(term):
+                posting = self.postings[indexed]
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                terms[indexed] = max(terms.get(indexed, 0.0), idf * weight)
+        if not terms:
+            return []
+
+        postings = [(self.postings[term], idf) for term, idf in terms.items()]
+        wanted = offset + limit
+        scores = {}
+        best = []  # min-heap of the page's scores so far
+
+        def score(doc):
+            value = scores[doc] = sum(idf * posting.get(doc, 0.0) for posting, idf in postings)
+            if len(best) < wanted:
+                heapq.heappush(best, value)
+            elif value > best[0]:
+                heapq.heapreplace(best, value)
+
+        def score_all(docs, shared):
+            # Term at a time, which beats score() per listing on large sets;
+            # every doc has the shared terms, so those skip the default
+            docs = [doc for doc in docs if doc not in scores]
+            totals = [0.0] * len(docs)
+            for posting, idf in postings:
+                if id(posting) in shared:
+                    totals = [total + idf * posting[doc] for total, doc in zip(totals, docs)]
+                else:
+                    get = posting.get
+                    totals = [total + idf * get(doc, 0.0) for total, doc in zip(totals, docs)]
+            scores.update(zip(docs, totals))
+            best[:] = heapq.nlargest(wanted, scores.values())
+            heapq.heapify(best)
+
+        # Every listing with a rare term is scored.  Terms in most listings
+        # ("well", "maintained") barely move a score and aren't walked.
+        dense = self.dense_size()
+        for term in terms:
+            if len(self.postings[term]) <= dense:
+                for doc in self.postings[term]:
+                    if doc not in scores:
+                        score(doc)
+        common = sorted((term for term in terms if dense < len(self.postings[term]) <= count * STOPWORD_SHARE),
+                        key=lambda term: len(self.postings[term]))
+        lists = [(self.ranked_posting(term), terms[term]) for term in common]
+
+        if len(common) > 1:
+            # Listings with every common term are the likely best matches;
+            # the intersection runs in C.
+            candidates = self.postings[common[0]].keys() & self.postings[common[1]].keys()
+            for term in common[2:]:
+                candidates &= self.postings[term].keys()
+            if len(candidates) > CONJUNCTIVE_MAX:
+                # Too many to score: walk the lists among those listings only
+                self.walk(lists, scores, best, wanted, score, candidates)
+            else:
+                score_all(candidates, {id(self.postings[term]) for term in common})
+                self.walk(lists, scores, best, wanted, score, all_scored=True)
+        elif common:
+            self.walk(lists, scores, best, wanted, score)
+        elif not scores:
+            # Only very common words, e.g. "tata" in a catalog of Tatas
+            self.walk([(self.ranked_posting(term), idf) for term, idf in terms.items()], scores, best, wanted, score)
+
+        top = heapq.nlargest(wanted, scores.items(), key=itemgetter(1))
+        return [self.doc_ids[doc] for doc, _ in top[offset:]]
+
+    @staticmethod
+    def walk(lists, scores, best, wanted, score, candidates=None, all_scored=False):
+        """Fagin's threshold algorithm over weight-sorted postings.
+
+        A listing not reached yet weighs at most the last weight read from
+        each list, so the walk stops once the page's worst score beats their
+        sum.  With all_scored, every listing with all the terms is already
+        scored, so an unseen one lacks at least the smallest of them.
+        """
+        positions = [0] * len(lists)
+        for _ in range(MAX_DEPTH):
+            threshold = 0.0
+            smallest = float("inf")
+            for number, (ranked, idf) in enumerate(lists):
+                position = positions[number]
+                if candidates is not None:
+                    while position < len(ranked) and ranked[position][1] not in candidates:
+                        position += 1
+                contribution = 0.0
+                if position < len(ranked):
+                    negative_weight, doc = ranked[position]
+                    contribution = -idf * negative_weight
+                    if doc not in scores:
+                        score(doc)
+                    position += 1
+                positions[number] = position
+                threshold += contribution
+                smallest = min(smallest, contribution)
+            if all_scored:
+                threshold -= smallest
+            if not threshold or (len(best) == wanted and best[0] >= threshold):
+                return
+
+
+class SearchIndex(Snapshot):
+    """Full-text search over the visible listings, held in this process.
+
+    Built in the background at startup with one pass over the collection
+    and kept current by the write endpoints (see snapshots.py).
+    """
+
+    name = "search index"
+
+    def __init__(self, collection, max_age=900):
+        super().__init__(max_age)
+        self.collection = collection
+
+    def build(self):
+        index = InvertedIndex()
+        for vehicle in self.collection.find({"to_show": True}, SEARCH_FIELDS):
+            index.add(str(vehicle["_id"]), vehicle)
+        index.rank_common_terms()
+        return index
+
+    def apply(self, index, change):
+        vehicle_id, vehicle = change
+        if vehicle is None:
+            index.remove(vehicle_id)
+        else:
+            index.add(vehicle_id, vehicle)
+
+    def search(self, query, limit, offset=0):
+        """Ranked ids, or None when there is no index to search."""
+        index = self.get()
+        if index is None:
+            return None
+        with self.lock:
+            return index.search(query, limit, offset)
+
+    def update(self, vehicle_id, vehicle=None):
+        self.report((str(vehicle_id), vehicle))
+
+    def added(self, vehicle):
+        if vehicle.get("to_show"):
+            self.update(vehicle["_id"], vehicle)
+
+    def shown(self, vehicle):
+        self.update(vehicle["_id"], vehicle)
+
+    def removed(self, vehicle):
+        self.update(vehicle["_id"])
+
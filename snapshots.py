@@ -0,0 +1,110 @@
+"""Copies of Mongo data held in this process, so hot reads skip the database.
+
+Every worker process holds its own copy.  The write endpoints report what
+they change, so a worker sees its own writes straight away; writes made by
+other worker processes only reach it once its copy is older than max_age
+seconds and is rebuilt.  max_age is therefore how far behind another
+worker's writes a copy can be.
+"""
+import threading
+import time
+
+
+def expired(since, max_age):
+    """Whether something stamped with time.monotonic() at since is older than max_age seconds."""
+    return time.monotonic() - since > max_age
+
+
+class Snapshot:
+    """One copy, built on a background thread and rebuilt there once stale.
+
+    Only one build runs at a time and the old copy keeps answering while it
+    does.  A build may already have read past a change reported while it
+    runs, so those changes are replayed onto the new copy.  Subclasses
+    provide build() and apply(current, change).
+    """
+
+    name = "snapshot"
+
+    # Replay is only safe where applying a change twice is harmless
+    replays = True
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.current = None
+        self.loaded_at = 0
+        self.reloading = False
+        self.finished = None  # set when the running build ends
+        self.replay = []  # changes reported while a build was running
+        self.started = False
+
+    def build(self):
+        raise NotImplementedError
+
+    def apply(self, current, change):
+        raise NotImplementedError
+
+    def load(self):
+        current = self.build()
+        with self.lock:
+            for change in self.replay:
+                self.apply(current, change)
+            self.replay = []
+            self.current = current
+            self.loaded_at = time.monotonic()
+            self.reloading = False
+
+    def reload_in_background(self):
+        """Start a build unless one is running; returns an event set when it ends."""
+        with self.lock:
+            if self.reloading:
+                return self.finished
+            self.reloading = True
+            finished = self.finished = threading.Event()
+
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                print(f"Error loading the {self.name}:", e)
+                with self.lock:
+                    self.reloading = False
+                    self.replay = []
+            finally:
+                finished.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        return finished
+
+    def start(self):
+        """Build the first copy in the background, once per process."""
+        if not self.started:
+            self.started = True
+            self.reload_in_background()
+
+    def stale(self):
+        return expired(self.loaded_at, self.max_age)
+
+    def get(self, wait=True):
+        """The current copy.
+
+        With no copy yet, waits for the first build, or returns None at once
+        if wait is False; also None if that build failed.
+        """
+        if self.current is None:
+            # Every caller waits on the one build rather than starting its own
+            finished = self.reload_in_background()
+            if wait:
+                finished.wait()
+        elif self.stale():
+            self.reload_in_background()
+        return self.current
+
+    def report(self, change):
+        """Apply a change a write endpoint made, to this copy and any build in progress."""
+        with self.lock:
+            if self.reloading and self.replays:
+                self.replay.append(change)
+            if self.current is not None:
+                self.apply(self.current, change)
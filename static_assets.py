@@ -0,0 +1,115 @@
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+from flask import send_file
+
+
+# Precompressed siblings looked for next to every file, best first
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+IMMUTABLE_MAX_AGE = 31536000  # one year
+
+
+class Asset:
+    __slots__ = ("path", "mimetype", "etag", "immutable", "encodings")
+
+    def __init__(self, path, mimetype, etag, immutable, encodings):
+        self.path = path
+        self.mimetype = mimetype
+        self.etag = etag
+        self.immutable = immutable
+        self.encodings = encodings
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AssetTable:
+    """Route table for the React build directory, scanned once.
+
+    Files listed under /static/ in asset-manifest.json carry a content hash in
+    their name, so they are cached as immutable and their ETag comes from the
+    name.  Every other file gets an ETag from its content and must be
+    revalidated.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+        hashed = set()
+        try:
+            with open(os.path.join(root, "asset-manifest.json"), "r") as file:
+                hashed = {url for url in json.load(file).get("files", {}).values() if url.startswith("/static/")}
+        except (OSError, ValueError) as e:
+            print("Error reading asset manifest:", e)
+
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith(tuple(extension for _, extension in ENCODINGS)):
+                    continue
+                path = os.path.join(directory, filename)
+                url = "/" + os.path.relpath(path, root).replace(os.sep, "/")
+                immutable = url in hashed
+                etag = hashlib.sha1(url.encode()).hexdigest() if immutable else file_digest(path)
+                self.assets[url] = Asset(
+                    path=path,
+                    mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                    etag=etag,
+                    immutable=immutable,
+                    encodings={name: path + extension for name, extension in ENCODINGS if os.path.exists(path + extension)},
+                )
+        if not self.assets:
+            print("Warning: no frontend build found in", root)
+
+    def get(self, url):
+        return self.assets.get(url)
+
+    def get_or_index(self, url):
+        """The asset at url, falling back to index.html for client-side routes."""
+        return self.assets.get(url) or self.assets.get("/index.html")
+
+
+def asset_response(asset, request):
+    """Serve an asset with its caching headers, a precompressed body when accepted, and 304s."""
+    path, etag, encoding = asset.path, asset.etag, None
+    for name, variant in asset.encodings.items():
+        if request.accept_encodings[name]:
+            path, etag, encoding = variant, f"{asset.etag}-{name}", name
+            break
+
+    # Without a max_age, send_file marks the response no-cache (always revalidate)
+    max_age = IMMUTABLE_MAX_AGE if asset.immutable else None
+    response = send_file(
+        path, mimetype=asset.mimetype, download_name=os.path.basename(asset.path),
+        etag=etag, conditional=True, max_age=max_age,
+    )
+    if asset.immutable:
+        response.cache_control.immutable = True
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if asset.encodings:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+asset_tables = {}
+asset_tables_lock = threading.Lock()
+
+
+def get_asset_table(root):
+    """Scan the build directory on first use; later lookups are dictionary hits."""
+    table = asset_tables.get(root)
+    if table is None:
+        with asset_tables_lock:
+            table = asset_tables.get(root)
+            if table is None:
+                table = asset_tables[root] = AssetTable(root)
+    return table
@@ -0,0 +1,114 @@
+from snapshots import Snapshot
+
+
+# Fields a taxonomy update needs from a vehicle document.
+TAXONOMY_FIELDS = {"category": 1, "brand": 1, "model": 1, "to_show": 1}
+
+
+class TaxonomyCounts:
+    def __init__(self, counts):
+        self.counts = counts  # (category, brand, model) -> [total, visible]
+        self.tree = None  # built from the counts on first use
+
+
+class Taxonomy(Snapshot):
+    """In-process category -> brand -> model tree with listing counts.
+
+    Built with one aggregation and kept current by the write endpoints,
+    which report each vehicle they add, show or delete (see snapshots.py).
+    """
+
+    name = "taxonomy"
+
+    # Changes are count deltas, which a rebuild may already include
+    replays = False
+
+    def __init__(self, collection, max_age=300):
+        super().__init__(max_age)
+        self.collection = collection
+
+    def build(self):
+        pipeline = [{"$group": {
+            "_id": {"category": "$category", "brand": "$brand", "model": "$model"},
+            "total": {"$sum": 1},
+            "visible": {"$sum": {"$cond": [{"$eq": ["$to_show", True]}, 1, 0]}},
+        }}]
+        counts = {}
+        for row in self.collection.aggregate(pipeline):
+            key = (row["_id"].get("category"), row["_id"].get("brand"), row["_id"].get("model"))
+            counts[key] = [row["total"], row["visible"]]
+        return TaxonomyCounts(counts)
+
+    def apply(self, current, change):
+        key, total, visible = change
+        total_count, visible_count = current.counts.get(key, (0, 0))
+        if total_count + total <= 0:
+            current.counts.pop(key, None)
+        else:
+            current.counts[key] = [total_count + total, visible_count + visible]
+        current.tree = None
+
+    def get_current(self):
+        current = self.get()
+        if current is None:
+            raise RuntimeError("The taxonomy could not be loaded")
+        return current
+
+    def get_counts(self):
+        """Snapshot of the counts."""
+        current = self.get_current()
+        with self.lock:
+            return dict(current.counts)
+
+    def update(self, vehicle, total=0, visible=0):
+        self.report(((vehicle.get("category"), vehicle.get("brand"), vehicle.get("model")), total, visible))
+
+    def added(self, vehicle):
+        self.update(vehicle, total=1, visible=1 if vehicle.get("to_show") else 0)
+
+    def shown(self, vehicle):
+        self.update(vehicle, visible=1)
+
+    def removed(self, vehicle):
+        self.update(vehicle, total=-1, visible=-1 if vehicle.get("to_show") else 0)
+
+    def brands(self, category):
+        return sorted({b for (c, b, m) in self.get_counts() if c == category and b is not None})
+
+    def models(self, brand, category=None):
+        """Models of a brand, in one category or across all of them."""
+        return sorted({
+            m for (c, b, m) in self.get_counts()
+            if b == brand and (category is None or c == category) and m is not None
+        })
+
+    def tree(self):
+        """The whole taxonomy with visible listing counts at every level."""
+        current = self.get_current()
+        with self.lock:
+            if current.tree is None:
+                current.tree = build_tree(current.counts)
+            return current.tree
+
+
+def build_tree(counts):
+    categories = {}
+    for (category, brand, model), (total, visible) in counts.items():
+        if category is None or brand is None:
+            continue
+        models = categories.setdefault(category, {}).setdefault(brand, {})
+        models[model] = models.get(model, 0) + visible
+
+    tree = []
+    for category, brands in sorted(categories.items()):
+        brand_nodes = [{
+            "name": brand,
+            "count": sum(models.values()),
+            "models": [{"name": m, "count": models[m]} for m in sorted(m for m in models if m is not None)],
+        } for brand, models in sorted(brands.items())]
+        tree.append({
+            "name": category,
+            "count": sum(node["count"] for node in brand_nodes),
+            "brands": brand_nodes,
+        })
+    return tree
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+
+CHUNK_SIZE = 1 << 16
+
+# <sha256><.ext> names written by ContentStore
+CONTENT_NAME_RE = re.compile(r"^([0-9a-f]{64})(\.[a-z0-9]{1,10})?$")
+# Names the old uuid-based upload_file produced, still served from the top level
+LEGACY_NAME_RE = re.compile(r"^[\w\-]+(\.[A-Za-z0-9]{1,10})?$")
+
+
+class UploadError(ValueError):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class HashingWriter:
+    """Temporary file that hashes and counts bytes as they are written."""
+
+    def __init__(self, directory, max_bytes):
+        os.makedirs(directory, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.max_bytes = max_bytes
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise UploadTooLarge(f"File exceeds the {self.max_bytes} byte limit")
+        self.sha256.update(data)
+        self.file.write(data)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.remove(self.file.name)
+
+
+class ContentStore:
+    """Uploads stored by the SHA-256 of their bytes.
+
+    A file lives at <root>/<aa>/<bb>/<sha256><.ext>, so re-uploading the same
+    photo stores nothing new, and a name never points at different bytes.
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp = os.path.join(root, "tmp")
+
+    def path_for(self, filename):
+        """Disk path for an upload name, or None if the name isn't one we serve."""
+        match = CONTENT_NAME_RE.match(filename)
+        if match:
+            digest = match.group(1)
+            return os.path.join(self.root, digest[:2], digest[2:4], filename)
+        if LEGACY_NAME_RE.match(filename):
+            return os.path.join(self.root, filename)
+        return None
+
+    def is_content_addressed(self, filename):
+        return bool(CONTENT_NAME_RE.match(filename))
+
+    def commit(self, writer, extension):
+        """Move a finished upload to its content address and return its name."""
+        writer.file.close()
+        filename = writer.sha256.hexdigest() + extension
+        path = self.path_for(filename)
+        if os.path.exists(path):
+            writer.discard()  # same bytes already stored
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(writer.file.name, path)
+        return filename
+
+    def save_multipart(self, request, field="file"):
+        """Stream one file field of a multipart request to disk.
+
+        The body is parsed as it arrives, so only one chunk is held in memory
+        no matter how large the upload is.  Returns the stored name.
+        """
+        boundary = request.mimetype_params.get("boundary")
+        if request.mimetype != "multipart/form-data" or not boundary:
+            raise UploadError("No file part")
+
+        decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=4 * CHUNK_SIZE)
+        writer = None
+        extension = None
+        in_field = done = False
+        try:
+            for chunk in iter(lambda: request.stream.read(CHUNK_SIZE), b""):
+                decoder.receive_data(chunk)
+                event = decoder.next_event()
+                while not isinstance(event, (NeedData, Epilogue)) and not done:
+                    if isinstance(event, File) and event.name == field and writer is None:
+                        if not event.filename:
+                            raise UploadError("No selected file")
+                        extension = safe_extension(event.filename)
+                        writer = HashingWriter(self.tmp, self.max_bytes)
+                        in_field = True
+                    elif isinstance(event, (Field, File)):
+                        in_field = False
+                    elif isinstance(event, Data) and in_field:
+                        writer.write(event.data)
+                        done = not event.more_data
+                    event = decoder.next_event()
+                if done:
+                    break
+            if not done:
+                raise UploadError("No file part")
+            return self.commit(writer, extension)
+        except Exception:
+            if writer:
+                writer.discard()
+            raise
+
+
+def safe_extension(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return extension if re.match(r"^\.[a-z0-9]{1,10}$", extension) else ""
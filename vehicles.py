@@ -0,0 +1,47 @@
+from geo import geo_point
+from locations import city_key, get_location_index
+
+
+# Filters accepted by GET /api/vehicles, mapped to the lowercase shadow field
+# that add_vehicle (and the backfill-filters command) stores next to the
+# original value.  Equality matches on these fields can use the indexes in
+# indexes.py, unlike the old anchored case-insensitive regexes.
+NORMALIZED_FIELDS = {
+    "category": "category_norm",
+    "brand": "brand_norm",
+    "model": "model_norm",
+    "state": "state_norm",
+    "condition": "condition_norm",
+}
+
+# Derived fields kept for querying only; they never appear in responses.
+INTERNAL_FIELDS = [*NORMALIZED_FIELDS.values(), "city_key", "geo"]
+
+
+def normalize(value):
+    """Lowercase and trim a filter value so it can be matched exactly."""
+    if not isinstance(value, str):
+        return None
+    return value.strip().lower()
+
+
+def normalized_fields(vehicle):
+    """Build the shadow filter fields for a vehicle document."""
+    location = vehicle.get("location") or []
+    return {
+        "category_norm": normalize(vehicle.get("category")),
+        "brand_norm": normalize(vehicle.get("brand")),
+        "model_norm": normalize(vehicle.get("model")),
+        "state_norm": normalize(location[0] if location else None),
+        "condition_norm": normalize(vehicle.get("vehicle_condition")),
+        "city_key": city_key(*location[:2]) if len(location) >= 2 else None,
+    }
+
+
+def geo_fields(vehicle):
+    """Resolve the vehicle's [State, City] to a GeoJSON point using location.json."""
+    location = vehicle.get("location") or []
+    coordinates = get_location_index().coordinates(*location[:2]) if len(location) >= 2 else None
+    if not coordinates:
+        return {}
+    return {"geo": geo_point(*coordinates)}
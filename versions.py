@@ -0,0 +1,51 @@
+import os
+import threading
+import time
+
+from snapshots import expired
+
+
+class CatalogVersion:
+    """A version number for the catalog, and one per listing, that writes bump.
+
+    Read routes turn them into ETags, so a client holding the current one
+    gets a 304 without Mongo being asked anything.  Tags carry the process
+    id and start time, so one worker never answers for what another has
+    served, and the epoch rolls over every max_age seconds (see
+    snapshots.py).
+    """
+
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self.prefix = f"{os.getpid():x}-{int(time.time()):x}"
+        self.epoch = 0
+        self.version = 0
+        self.documents = {}  # listing id -> version of its last write this epoch
+        self.rolled_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def roll(self):
+        # Caller holds the lock
+        if expired(self.rolled_at, self.max_age):
+            self.epoch += 1
+            self.version = 0
+            self.documents.clear()
+            self.rolled_at = time.monotonic()
+
+    def bump(self, ids=()):
+        """Record a write to the catalog touching the given listing ids."""
+        with self.lock:
+            self.roll()
+            self.version += 1
+            for vehicle_id in ids:
+                self.documents[str(vehicle_id)] = self.version
+
+    def etag(self):
+        with self.lock:
+            self.roll()
+            return f"{self.prefix}-{self.epoch:x}-{self.version:x}"
+
+    def document_etag(self, vehicle_id):
+        with self.lock:
+            self.roll()
+            return f"{self.prefix}-{self.epoch:x}-d{self.documents.get(vehicle_id, 0):x}"